@@ -0,0 +1,57 @@
+"""
+Asset registry for the Grocery Guard screens.
+Fonts are loaded once per size and shared by every screen, and static labels and
+icons are rendered once at startup, so opening a screen doesn't reload or
+rasterize anything.
+"""
+
+import pygame
+
+class Assets(object):
+   """
+   sizes are the font sizes loaded by load(). path is the font file, None for
+   pygame's default font.
+   """
+
+   def __init__(self, sizes=(20,25,26,30,40), path=None):
+      self.sizes = tuple(sizes)
+      self.path = path
+      self.fonts = {} # size -> pygame.font.Font
+      self.labels = {} # (size, text, color) -> rendered surface
+      self.icons = {} # name -> surface
+
+   def load(self, labels=(), icons=None):
+      """
+      Load every font size, then pre-render labels, an iterable of
+      (size, text, color), and icons, a dict of name -> function returning the
+      icon's surface.
+      """
+      for size in self.sizes:
+         self.font(size)
+      for size, text, color in labels:
+         self.label(size, text, color)
+      for name, draw in (icons or {}).items():
+         self.icons[name] = draw()
+
+   def font(self, size):
+      """
+      Shared font of the given size.
+      """
+      font = self.fonts.get(size)
+      if font is None:
+         font = self.fonts[size] = pygame.font.Font(self.path, size)
+      return font
+
+   def label(self, size, text, color):
+      """
+      Surface of a static text in the font of the given size. Rendered on first
+      use and kept for good, so only use it for text from a fixed set.
+      """
+      key = (size, text, tuple(color))
+      surface = self.labels.get(key)
+      if surface is None:
+         surface = self.labels[key] = self.font(size).render(text, True, color)
+      return surface
+
+   def icon(self, name):
+      return self.icons[name]
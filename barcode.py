@@ -0,0 +1,150 @@
+"""
+Frame preparation for barcode decoding.
+Converts camera frames to the 8 bit grayscale images zbar expects, using integer
+arithmetic into buffers that are allocated once and reused for every frame.
+"""
+
+import numpy as np
+
+# fixed point (8 bit) versions of the 0.299, 0.587, 0.114 luma weights
+LUMA_R = 77
+LUMA_G = 150
+LUMA_B = 29
+
+class GrayscaleConverter(object):
+   """
+   Converts RGB frames to grayscale into a preallocated uint8 buffer.
+   channel selects a single color channel (0,1,2) to use as the gray level instead
+   of computing luma. Green carries most of the luma and is the cheapest option.
+   The returned array is owned by the converter and overwritten by the next call.
+   gray is an optional (height,width) uint8 array to convert into, e.g. a view of
+   shared memory.
+   """
+
+   def __init__(self, channel=None, gray=None):
+      self.channel = channel
+      self.gray = gray # (height,width) uint8 output buffer
+      self._acc = None # (height,width) uint16 accumulator
+      self._tmp = None # (height,width) uint16 scratch
+
+   def _buffers(self, shape):
+      if self.gray is None or self.gray.shape != shape:
+         self.gray = np.empty(shape, np.uint8)
+      if self._acc is None or self._acc.shape != shape:
+         self._acc = np.empty(shape, np.uint16)
+         self._tmp = np.empty(shape, np.uint16)
+
+   def convert(self, rgb):
+      """
+      Convert rgb, a (height,width,3 or 4) uint8 array or view, to grayscale.
+      Returns a C-contiguous (height,width) uint8 array.
+      """
+      self._buffers(rgb.shape[:2])
+      if self.channel is not None:
+         np.copyto(self.gray, rgb[...,self.channel])
+         return self.gray
+      acc = self._acc
+      tmp = self._tmp
+      # Y = (77*R + 150*G + 29*B) >> 8, fits in 16 bits
+      np.multiply(rgb[...,0], LUMA_R, out=acc, dtype=np.uint16)
+      np.multiply(rgb[...,1], LUMA_G, out=tmp, dtype=np.uint16)
+      acc += tmp
+      np.multiply(rgb[...,2], LUMA_B, out=tmp, dtype=np.uint16)
+      acc += tmp
+      acc >>= 8
+      np.copyto(self.gray, acc, casting='unsafe')
+      return self.gray
+
+   def convert_surface(self, surface):
+      """
+      Convert a pygame Surface to grayscale without copying its pixels.
+      surfarray indexes pixels as [x][y]; the view is transposed to [y][x] (rows
+      first) which is the layout zbar expects.
+      """
+      import pygame.surfarray
+      view = pygame.surfarray.pixels3d(surface)
+      try:
+         return self.convert(view.transpose(1,0,2))
+      finally:
+         # release the surface lock held by the pixel view
+         del view
+
+class ChangeGate(object):
+   """
+   Cheap frame-difference gate used to skip zbar decoding when the scene is static.
+   Each grayscale frame is downsampled by taking every step-th pixel and compared
+   with the previous frame by mean absolute difference. A frame counts as changed
+   when the difference exceeds threshold (in gray levels). Decoding stays enabled
+   for hold frames after the last change so an item held still is still read.
+   """
+
+   def __init__(self, threshold=4.0, step=8, hold=3):
+      self.threshold = threshold
+      self.step = step
+      self.hold = hold
+      self.active = False # True if the last frame passed the gate
+      self.difference = 0.0 # mean absolute difference of the last frame
+      self._left = 0 # frames left in the hold window
+      self._prev = None
+      self._cur = None
+      self._diff = None
+
+   def reset(self):
+      """
+      Forget the previous frame so the next one always passes.
+      """
+      self._prev = None
+
+   def changed(self, gray):
+      """
+      Return True if gray should be decoded.
+      """
+      small = gray[::self.step,::self.step]
+      if self._prev is None or self._prev.shape != small.shape:
+         self._prev = np.empty(small.shape, np.int16)
+         self._cur = np.empty(small.shape, np.int16)
+         self._diff = np.empty(small.shape, np.int16)
+         np.copyto(self._prev, small)
+         self.difference = float('inf')
+         self._left = self.hold
+         self.active = True
+         return True
+
+      np.copyto(self._cur, small)
+      np.subtract(self._cur, self._prev, out=self._diff)
+      np.abs(self._diff, out=self._diff)
+      self.difference = self._diff.mean()
+      self._prev, self._cur = self._cur, self._prev
+
+      if self.difference > self.threshold:
+         self._left = self.hold
+      elif self._left > 0:
+         self._left -= 1
+      else:
+         self.active = False
+         return False
+      self.active = True
+      return True
+
+class PollInterval(object):
+   """
+   Adaptive scanning interval in seconds. Drops to fast as soon as motion is seen
+   and backs off geometrically (by backoff per idle poll) up to slow.
+   """
+
+   def __init__(self, fast=0.2, slow=2.0, backoff=1.5):
+      self.fast = fast
+      self.slow = slow
+      self.backoff = backoff
+      self.interval = fast
+
+   def update(self, active):
+      """
+      Adjust the interval after a poll. active is True if the poll saw motion.
+      Returns the new interval.
+      """
+      if active:
+         self.interval = self.fast
+      else:
+         self.interval = min(self.slow, self.interval*self.backoff)
+      return self.interval
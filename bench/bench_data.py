@@ -0,0 +1,302 @@
+"""
+Benchmark of the Grocery Guard data access functions at realistic scale.
+Fills the codes, recipes and fridge tables of a scratch Postgres database with
+deterministic synthetic data at several sizes, then times get_ingredients,
+get_notifications, get_recipes (cold and warm, cached and streaming),
+add_to_fridge, update_fridge and the recipe detail load behind the single recipe
+screen. Queries are counted per call through a wrapper around the app's
+connections. Results are printed and written as JSON.
+
+The tables of the benchmark database are DROPPED and recreated; never point it at
+the device's real database.
+Usage: python bench/bench_data.py [--dsn DSN] [--sizes small,medium,large]
+                                  [--repeat N] [--out results.json]
+"""
+
+from __future__ import print_function
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import timeit
+
+try:
+   from cStringIO import StringIO
+except ImportError:
+   from io import StringIO
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, ROOT)
+
+BENCH_DSN = os.environ.get('GROCERY_GUARD_BENCH_DSN', 'dbname=grocery_guard_bench')
+
+# name -> (codes, recipes, fridge items)
+SIZES = {'small': (1000, 100, 10),
+         'medium': (10000, 5000, 200),
+         'large': (100000, 50000, 2000)}
+
+SCHEMA = ["drop table if exists fridge, recipes, codes",
+          "create table codes (id bigint primary key, name text not null, "
+          "quantity numeric not null, exp_days integer not null)",
+          "create table recipes (id integer primary key, name text not null, "
+          "ingredients bigint[] not null, amounts numeric[] not null, instructions text not null)",
+          "create table fridge (id bigint primary key, name text not null, "
+          "quantity numeric not null, added date not null, exp_days integer not null)"]
+
+WORDS = ['apple', 'bean', 'butter', 'carrot', 'cheese', 'chicken', 'egg', 'flour',
+         'garlic', 'lemon', 'milk', 'onion', 'pepper', 'rice', 'salmon', 'tomato']
+
+# --------------- synthetic data ---------------- #
+
+class Generator(object):
+   """
+   Deterministic synthetic codes, recipes and fridge contents. The same seed and
+   sizes always give the same rows. Ingredient popularity is skewed so a few
+   products appear in many recipes, as staples do.
+   """
+
+   def __init__(self, codes, recipes, fridge, seed=0):
+      self.n_codes = codes
+      self.n_recipes = recipes
+      self.n_fridge = fridge
+      self.seed = seed
+      self.ids = [] # code ids, most popular first
+      self.rows = {} # code id -> codes row
+
+   def _popular(self, rng):
+      # index into self.ids, skewed towards the start
+      return int(len(self.ids) * rng.random()**3)
+
+   def codes(self):
+      rng = random.Random(self.seed)
+      # unique 12 digit UPCs
+      seen = set()
+      self.ids = []
+      self.rows = {}
+      while len(self.ids) < self.n_codes:
+         id = rng.randrange(10**11, 10**12)
+         if id not in seen:
+            seen.add(id)
+            self.ids.append(id)
+      for n, id in enumerate(self.ids):
+         name = '%s %d' % (WORDS[n % len(WORDS)], n)
+         row = (id, name, rng.randint(1, 10), rng.randint(1, 30))
+         self.rows[id] = row
+         yield row
+
+   def recipes(self):
+      rng = random.Random(self.seed+1)
+      for id in range(1, self.n_recipes+1):
+         ingredients = set()
+         for i in range(rng.randint(3, 12)):
+            ingredients.add(self.ids[self._popular(rng)])
+         ingredients = sorted(ingredients)
+         amounts = [rng.randint(1, 5) for ing in ingredients]
+         steps = ['Step %d of recipe %d: stir the %s gently for %d minutes.'
+                  % (i+1, id, WORDS[rng.randrange(len(WORDS))], rng.randint(1, 20))
+                  for i in range(rng.randint(3, 8))]
+         yield (id, 'recipe %d' % id, ingredients, amounts, "\n".join(steps))
+
+   def fridge(self):
+      rng = random.Random(self.seed+2)
+      today = datetime.date.today()
+      ids = set()
+      while len(ids) < min(self.n_fridge, len(self.ids)):
+         ids.add(self.ids[self._popular(rng)])
+      for id in sorted(ids):
+         # name and shelf life as in codes, as add_to_fridge would store them
+         code = self.rows[id]
+         added = today - datetime.timedelta(rng.randint(0, 30))
+         yield (id, code[1], rng.randint(1, 10), added.isoformat(), code[3])
+
+def pg_array(values):
+   return '{' + ','.join(str(v) for v in values) + '}'
+
+def copy_rows(cur, table, rows):
+   buf = StringIO()
+   writer = csv.writer(buf)
+   for row in rows:
+      writer.writerow([pg_array(v) if isinstance(v, list) else v for v in row])
+   buf.seek(0)
+   cur.copy_expert("copy %s from stdin with (format csv)" % table, buf)
+
+def fill(db, gen):
+   """
+   Recreate the tables and fill them from gen.
+   """
+   with db.cursor() as cur:
+      for msg in SCHEMA:
+         cur.execute(msg)
+      copy_rows(cur, 'codes', gen.codes())
+      copy_rows(cur, 'recipes', gen.recipes())
+      copy_rows(cur, 'fridge', gen.fridge())
+      cur.execute("analyze")
+
+# --------------- query counting ---------------- #
+
+class CountingCursor(object):
+   """
+   DB-API cursor wrapper counting execute() calls (round trips) in stats.
+   """
+
+   def __init__(self, cur, stats):
+      self._cur = cur
+      self._stats = stats
+
+   def execute(self, query, args=None):
+      self._stats['queries'] += 1
+      return self._cur.execute(query, args)
+
+   def executemany(self, query, args):
+      self._stats['queries'] += 1
+      return self._cur.executemany(query, args)
+
+   def __iter__(self):
+      return iter(self._cur)
+
+   def __getattr__(self, name):
+      return getattr(self._cur, name)
+
+class CountingConnection(object):
+
+   def __init__(self, conn, stats):
+      self._conn = conn
+      self._stats = stats
+
+   def cursor(self, *args, **kwargs):
+      return CountingCursor(self._conn.cursor(*args, **kwargs), self._stats)
+
+   def __getattr__(self, name):
+      return getattr(self._conn, name)
+
+# --------------- benchmark ---------------- #
+
+def load_app():
+   """
+   Import code.py as the grocery_guard module (code is also a standard library
+   module name).
+   """
+   path = os.path.join(ROOT, 'code.py')
+   try:
+      import importlib.util
+   except ImportError:
+      import imp
+      return imp.load_source('grocery_guard', path)
+   spec = importlib.util.spec_from_file_location('grocery_guard', path)
+   module = importlib.util.module_from_spec(spec)
+   sys.modules['grocery_guard'] = module
+   spec.loader.exec_module(module)
+   return module
+
+def measure(stats, fn, repeat, setup=None):
+   """
+   Call fn repeat times (after setup, if given, which isn't timed or counted).
+   Returns per call times in ms and the number of queries per call.
+   """
+   times = []
+   queries = 0
+   for i in range(repeat):
+      if setup is not None:
+         setup(i)
+      stats['queries'] = 0
+      start = timeit.default_timer()
+      fn(i)
+      times.append((timeit.default_timer()-start)*1000.0)
+      queries += stats['queries']
+   return times, float(queries)/repeat
+
+def summary(times):
+   times = sorted(times)
+   return {'min_ms': times[0], 'median_ms': times[len(times)//2],
+           'mean_ms': sum(times)/len(times), 'max_ms': times[-1]}
+
+def bench_size(app, stats, name, repeat):
+   codes, recipes, fridge = SIZES[name]
+   gen = Generator(codes, recipes, fridge)
+   fill(app.db, gen)
+   app.create_indexes()
+   app.catalog.invalidate()
+   app.catalog.load()
+   app.recipe_cache.invalidate()
+   app.recipe_index = None
+   app.RECIPE_STREAMING = False
+
+   rng = random.Random(3)
+   pantry = [row[0] for row in gen.fridge()]
+   recipe_ids = list(range(1, recipes+1))
+
+   def cold_recipes(i):
+      app.reload_recipes()
+      app.get_recipes()
+
+   def streaming_recipes(i):
+      app.RECIPE_STREAMING = True
+      try:
+         app.get_recipes()
+      finally:
+         app.RECIPE_STREAMING = False
+
+   def recipe_detail(i):
+      app.recipe_cache.get(rng.choice(recipe_ids))
+
+   cases = [('get_ingredients', lambda i: app.get_ingredients(), None),
+            ('get_notifications', lambda i: app.get_notifications(), None),
+            ('get_recipes (cold)', cold_recipes, None),
+            ('get_recipes (warm)', lambda i: app.get_recipes(), None),
+            ('get_recipes (streaming)', streaming_recipes, None),
+            ('add_to_fridge', lambda i: app.add_to_fridge(rng.choice(gen.ids)), None),
+            ('update_fridge', lambda i: app.update_fridge(rng.choice(pantry), 1), None),
+            ('recipe detail (uncached)', recipe_detail,
+             lambda i: app.recipe_cache.invalidate())]
+
+   results = []
+   for label, fn, setup in cases:
+      times, queries = measure(stats, fn, repeat, setup)
+      result = {'size': name, 'codes': codes, 'recipes': recipes, 'fridge': fridge,
+                'function': label, 'calls': repeat, 'queries_per_call': queries}
+      result.update(summary(times))
+      results.append(result)
+      print('%-8s %-26s %9.2f ms median %9.2f ms max %5.1f queries/call'
+            % (name, label, result['median_ms'], result['max_ms'], queries))
+   return results
+
+def version():
+   try:
+      out = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT)
+      return out.decode('ascii').strip()
+   except Exception:
+      return None
+
+def main():
+   parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+   parser.add_argument('--dsn', default=BENCH_DSN, help='scratch database (its tables are dropped)')
+   parser.add_argument('--sizes', default='small,medium,large')
+   parser.add_argument('--repeat', type=int, default=20)
+   parser.add_argument('--out', default=os.path.join(ROOT, 'bench', 'bench_data.json'))
+   args = parser.parse_args()
+
+   os.environ['GROCERY_GUARD_DSN'] = args.dsn
+   app = load_app()
+   stats = {'queries': 0}
+   connect = app.db.connect
+   app.db.close()
+   app.db.connect = lambda dsn: CountingConnection(connect(dsn), stats)
+
+   results = []
+   for name in args.sizes.split(','):
+      results.extend(bench_size(app, stats, name, args.repeat))
+
+   with open(args.out, 'w') as f:
+      json.dump({'version': version(), 'python': platform.python_version(),
+                 'machine': platform.machine(), 'repeat': args.repeat,
+                 'results': results}, f, indent=1, sort_keys=True)
+   print('wrote ' + args.out)
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,50 @@
+"""
+Micro-benchmark of the scan() grayscale conversion.
+Compares the original path (surfarray.array3d copy + float64 np.dot + astype)
+against GrayscaleConverter on a random 640x480 camera sized frame.
+Usage: python bench/bench_grayscale.py [iterations]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+os.environ.setdefault('SDL_VIDEODRIVER','dummy')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+import pygame
+import pygame.surfarray
+
+from barcode import GrayscaleConverter
+
+CAM_RES = (640,480)
+
+def original(surface):
+   img_arr = pygame.surfarray.array3d(surface)
+   img_arr = np.dot(img_arr[...,:3], [0.299, 0.587, 0.114])
+   return img_arr.astype(np.uint8)
+
+def main():
+   n = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+   surface = pygame.Surface(CAM_RES, depth=24)
+   rng = np.random.RandomState(0)
+   pygame.surfarray.blit_array(surface, rng.randint(0,256,CAM_RES+(3,)).astype(np.uint8))
+
+   luma = GrayscaleConverter()
+   green = GrayscaleConverter(channel=1)
+
+   # the two paths must agree to within fixed point rounding
+   diff = np.abs(original(surface).T.astype(int) - luma.convert_surface(surface).astype(int))
+   print("max abs difference vs original: %d" % diff.max())
+
+   for label,fn in [('original float64',original),
+                    ('fixed point luma',luma.convert_surface),
+                    ('green channel',green.convert_surface)]:
+      t = min(timeit.repeat(lambda: fn(surface), number=n, repeat=3))/n
+      print("%-18s %8.3f ms/frame" % (label, t*1000))
+
+if __name__ == "__main__":
+   main()
@@ -0,0 +1,412 @@
+"""
+Headless UI benchmark for the Grocery Guard screens.
+Runs the app's real screens, router, canvas and data executor on SDL's dummy video
+driver and replays a recorded sequence of touchscreen taps (MOUSEBUTTONDOWN/UP)
+and barcode scans through them: HomeScreen, FridgeScreen, RecipesScreen,
+NotificationsScreen, RecipeScreen, InstructionScreen and ItemAddedScreen (the old
+home_screen, display_fridge, display_recipes, display_notifications,
+display_single_recipe, display_instruction and display_item_added). Measures
+frames per second, the time from a tap to the first frame drawn for it (and to the
+screen's data being shown), and the memory allocated per frame with tracemalloc.
+
+Needs no PiTFT, touchscreen, camera, GPIO, speaker or Postgres: the scanner
+process, RPi.GPIO and the speech commands are replaced by the stubs below, and
+the data functions by an in-memory fridge filled with bench_data's generator.
+The power button is never tapped.
+
+A replay file is a JSON list of ["down", x, y], ["up", x, y] and ["scan", upc]
+steps; without one the built-in TOUR, which visits every screen, is used.
+Usage: python bench/bench_ui.py [--replay taps.json] [--rounds N] [--out results.json]
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import timeit
+import types
+
+import pygame
+from pygame.locals import MOUSEBUTTONDOWN, MOUSEBUTTONUP
+
+from bench_data import ROOT, Generator, load_app, summary, version
+
+import numpy as np
+from recipes import RecipeDetail, RecipeIndex, RecipeMatrix
+from scheduler import ExpiryScheduler
+
+try:
+   import tracemalloc
+   tracemalloc.reset_peak
+except (ImportError, AttributeError): # python 2 or < 3.9, no allocation pass
+   tracemalloc = None
+
+SCREENS = ['HomeScreen', 'FridgeScreen', 'RecipesScreen', 'NotificationsScreen',
+           'RecipeScreen', 'InstructionScreen', 'ItemAddedScreen']
+
+def tap(x, y):
+   return [['down', x, y], ['up', x, y]]
+
+# round trip through every screen, ending on the home screen
+TOUR = (tap(160,50) +                 # home -> fridge
+        tap(160,195) +                # next page
+        tap(305,30) +                 # delete the first item if it has expired
+        tap(160,220) +                # -> recipes
+        tap(100,40) +                 # -> best recipe
+        tap(160,190) +                # cook it
+        tap(75,220) +                 # -> instructions
+        tap(270,220) +                # next step
+        tap(260,10) + tap(260,10) +   # speech on and off
+        tap(50,220) +                 # previous step
+        tap(160,220) +                # back to the recipe
+        tap(250,220) +                # -> recipes
+        tap(270,220) +                # -> notifications
+        tap(160,195) +                # next page
+        tap(270,220) +                # -> fridge
+        tap(50,220) +                 # -> home
+        [['scan', None]] + tap(250,220) + # scan, correct
+        [['scan', None]] + tap(75,220) +  # scan, incorrect
+        [['scan', 1]] + tap(250,220) + tap(75,220) + # unknown code, can't be added
+        tap(160,150) + tap(50,220) +  # notifications and back
+        tap(50,225) +                 # start unpacking
+        [['scan', None]] + tap(250,220) + # queued scan
+        tap(50,225))                  # stop unpacking, writes the queue
+
+# --------------- stubs ---------------- #
+
+class StubScanner(object):
+   """
+   Stands in for the ScannerProcess and the camera it owns. scan() reports a
+   barcode the way the relay thread does, while the scanner is active.
+   """
+
+   def __init__(self, callback):
+      self.callback = callback
+      self.active = True
+
+   def start(self, callback=None):
+      pass
+
+   def pause(self):
+      self.active = False
+
+   def resume(self):
+      self.active = True
+
+   def stop(self):
+      pass
+
+   def snapshot(self):
+      return None
+
+   def scan(self, upc, quality=1):
+      if self.active:
+         self.callback(upc, quality)
+
+def stub_gpio():
+   """
+   Install an RPi.GPIO module that records its calls instead of touching pins.
+   """
+   gpio = types.ModuleType('RPi.GPIO')
+   gpio.BCM, gpio.IN, gpio.PUD_UP, gpio.FALLING = 11, 1, 22, 32
+   gpio.calls = []
+   def recorder(name):
+      def call(*args, **kwargs):
+         gpio.calls.append((name, args, kwargs))
+      return call
+   for name in ('setmode', 'setup', 'add_event_detect', 'cleanup'):
+      setattr(gpio, name, recorder(name))
+   package = types.ModuleType('RPi')
+   package.GPIO = gpio
+   sys.modules['RPi'] = package
+   sys.modules['RPi.GPIO'] = gpio
+   return gpio
+
+class StubSpeaker(object):
+   """
+   Speaker that remembers what it was asked to say instead of running espeak.
+   """
+
+   def __init__(self):
+      self.said = []
+
+   def say(self, text, wait=0.25):
+      self.said.append(text)
+
+   def prefetch(self, text):
+      pass
+
+   def speaking(self):
+      return False
+
+   def stop(self):
+      pass
+
+class FakeData(object):
+   """
+   In-memory Fridge, codes and recipes standing in for the Postgres back end.
+   install() replaces the app's data functions and caches; the recipe scores and
+   notifications are the app's own RecipeIndex and ExpiryScheduler, kept up to
+   date through fridge_changed() as they are on the device.
+   """
+
+   def __init__(self, app, codes=1000, recipes=100, fridge=40, seed=0):
+      self.app = app
+      gen = Generator(codes, recipes, fridge, seed)
+      self.codes = dict((row[0], row) for row in gen.codes())
+      self.ids = list(gen.ids)
+      self.items = list(gen.fridge())
+      self.fridge = {} # id -> [name, quantity, expires], filled by install()
+      self.recipes = list(gen.recipes())
+      self.details = {}
+      for id, name, ingredients, amounts, instructions in self.recipes:
+         names = [self.codes[upc][1] for upc in ingredients]
+         self.details[id] = RecipeDetail((id, name, ingredients, amounts, instructions, names))
+
+   def install(self):
+      """
+      Patch the app, starting from the generated Fridge contents.
+      """
+      app = self.app
+      self.fridge = {}
+      for id, name, quantity, added, exp_days in self.items:
+         added = datetime.datetime.strptime(added, '%Y-%m-%d').date()
+         self.fridge[id] = [name, quantity, added + datetime.timedelta(exp_days)]
+      for name in ('get_ingredients', 'get_item_name', 'add_to_fridge', 'add_items',
+                   'update_fridge', 'consume'):
+         setattr(app, name, getattr(self, name))
+      app.recipe_cache = self
+      matrix = RecipeMatrix([r[0] for r in self.recipes], [r[1] for r in self.recipes],
+                            [r[2] for r in self.recipes], [r[3] for r in self.recipes])
+      app.recipe_index = RecipeIndex(matrix, app.NUM_REC)
+      app.recipe_index.load_fridge(list(self.fridge), [item[1] for item in self.fridge.values()])
+      app.expiry = ExpiryScheduler(app.EXP_DAYS, app.ING_LOW, app.post_notify_event)
+      app.expiry.load([(id, item[0], item[1], item[2]) for id, item in self.fridge.items()])
+
+   # app data functions
+
+   def get_ingredients(self):
+      today = datetime.date.today()
+      return np.array([(id, item[0], item[1], (item[2]-today).days)
+                       for id, item in self.fridge.items()], dtype=self.app.FRIDGE_DTYPE)
+
+   def get_item_name(self, id):
+      code = self.codes.get(id)
+      return None if code is None else code[1].title()
+
+   def add_to_fridge(self, id):
+      self.add_items([id])
+
+   def add_items(self, ids):
+      today = datetime.date.today()
+      for id in ids:
+         code = self.codes.get(id)
+         if code is None:
+            continue
+         item = self.fridge.get(id)
+         if item is None:
+            item = self.fridge[id] = [code[1], 0, today + datetime.timedelta(code[3])]
+         item[1] += code[2]
+         self.app.fridge_changed(id, item[1], item[0], item[2])
+
+   def update_fridge(self, id, amt):
+      self.consume([(id, amt)])
+
+   def consume(self, items):
+      for id, amt in items:
+         item = self.fridge.get(int(id))
+         if item is None:
+            continue
+         item[1] -= amt
+         if amt == 0 or item[1] <= 0:
+            del self.fridge[int(id)]
+            self.app.fridge_changed(id, None)
+         else:
+            self.app.fridge_changed(id, item[1])
+
+   # RecipeCache
+
+   def get(self, id):
+      return self.details[int(id)]
+
+   def prefetch(self, ids):
+      return None
+
+   def invalidate(self, id=None):
+      pass
+
+# --------------- replay ---------------- #
+
+def setup():
+   """
+   Import the app and bring up its display on the dummy driver, with the stubs
+   in place of the hardware.
+   """
+   gpio = stub_gpio()
+   app = load_app()
+   app.init_display({'SDL_VIDEODRIVER': 'dummy'})
+   app.init_gpio()
+   app.loop.fps = 0 # no frame cap, replay as fast as the screens draw
+   app.assets.load(app.LABELS, {'power': app.power_icon})
+   app.speaker = StubSpeaker()
+   app.scanner = StubScanner(app.post_scan_event)
+   assert gpio.calls, 'init_gpio() did not configure the stub'
+   return app
+
+class Replay(object):
+   """
+   Replays steps through the app's router one event at a time, drawing a frame
+   after each like the event loop does. With trace, tracemalloc measures the
+   memory allocated during each frame (and slows the frames down).
+   """
+
+   def __init__(self, app, trace=False):
+      self.app = app
+      self.trace = trace
+      self.frames = {} # screen -> frame times in ms
+      self.allocs = {} # screen -> peak bytes allocated while drawing a frame
+      self.taps = {} # screen tapped -> ms from the tap to the frame drawn for it
+      self.loads = {} # screen -> ms from the tap to its data being shown
+      self.count = 0
+      self.elapsed = 0.0
+      # events the screens react to. peek() with no types loses the attributes
+      # of user events in pygame 2.6
+      self.types = [app.NOTIFY_EVENT, app.SCAN_EVENT, app.DATA_EVENT, app.UNPACK_EVENT,
+                    MOUSEBUTTONDOWN, MOUSEBUTTONUP]
+
+   def frame(self):
+      router = self.app.router
+      if self.trace:
+         tracemalloc.reset_peak()
+         base = tracemalloc.get_traced_memory()[0]
+      start = timeit.default_timer()
+      router.dispatch(self.app.loop.events())
+      end = timeit.default_timer()
+      name = type(router.current).__name__
+      self.frames.setdefault(name, []).append((end-start)*1000.0)
+      if self.trace:
+         self.allocs.setdefault(name, []).append(tracemalloc.get_traced_memory()[1]-base)
+      self.count += 1
+      return end
+
+   def settle(self, posted):
+      # draw until the screen has its data and the queue is empty
+      router = self.app.router
+      loading = getattr(router.current, 'pending', None) is not None
+      while getattr(router.current, 'pending', None) is not None or pygame.event.peek(self.types):
+         end = self.frame()
+      if loading:
+         name = type(router.current).__name__
+         self.loads.setdefault(name, []).append((end-posted)*1000.0)
+
+   def step(self, kind, *args):
+      app = self.app
+      tapped = type(app.router.current).__name__
+      posted = timeit.default_timer()
+      if kind == 'scan':
+         app.scanner.scan(args[0])
+         tapped = 'scan'
+      else:
+         event_type = MOUSEBUTTONDOWN if kind == 'down' else MOUSEBUTTONUP
+         pygame.event.post(pygame.event.Event(event_type, pos=(args[0], args[1]), button=1))
+      end = self.frame()
+      if kind != 'down':
+         self.taps.setdefault(tapped, []).append((end-posted)*1000.0)
+      self.settle(posted)
+
+   def run(self, steps, rounds, data):
+      router = self.app.router
+      start = timeit.default_timer()
+      for i in range(rounds):
+         # same Fridge every round
+         data.install()
+         if router.stack:
+            router.home()
+         else:
+            router.push(self.app.HomeScreen())
+         self.settle(timeit.default_timer())
+         for step in steps:
+            self.step(*step)
+      self.elapsed = timeit.default_timer() - start
+
+def resolve(steps, data):
+   # scans without a upc scan a known product
+   return [(s[0], data.ids[0]) if s[0] == 'scan' and s[1] is None else tuple(s)
+           for s in steps]
+
+def report(timing, alloc):
+   results = []
+   for name in SCREENS:
+      frames = timing.frames.get(name)
+      if not frames:
+         continue
+      result = {'screen': name, 'frames': len(frames)}
+      for key, times in (('frame', frames), ('tap', timing.taps.get(name)),
+                         ('load', timing.loads.get(name))):
+         if times:
+            for stat, value in summary(times).items():
+               result[key + '_' + stat] = value
+      result['fps'] = 1000.0/result['frame_mean_ms']
+      if alloc is not None and alloc.allocs.get(name):
+         allocs = alloc.allocs[name]
+         result['alloc_mean_bytes'] = float(sum(allocs))/len(allocs)
+         result['alloc_max_bytes'] = max(allocs)
+      results.append(result)
+   return results
+
+def main():
+   parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+   parser.add_argument('--replay', help='JSON list of recorded steps (default: the built-in tour)')
+   parser.add_argument('--rounds', type=int, default=20)
+   parser.add_argument('--no-alloc', action='store_true', help='skip the tracemalloc pass')
+   parser.add_argument('--out', default=os.path.join(ROOT, 'bench', 'bench_ui.json'))
+   args = parser.parse_args()
+
+   app = setup()
+   data = FakeData(app)
+   steps = TOUR
+   if args.replay:
+      with open(args.replay) as f:
+         steps = json.load(f)
+   steps = resolve(steps, data)
+
+   timing = Replay(app)
+   timing.run(steps, args.rounds, data)
+   alloc = None
+   if tracemalloc is not None and not args.no_alloc:
+      alloc = Replay(app, trace=True)
+      tracemalloc.start()
+      alloc.run(steps, args.rounds, data)
+      tracemalloc.stop()
+
+   results = report(timing, alloc)
+   fps = timing.count/timing.elapsed
+   print('%d frames in %.2f s, %.1f fps' % (timing.count, timing.elapsed, fps))
+   print('%-20s %7s %9s %9s %9s %9s %11s' % ('screen', 'frames', 'frame p50', 'max',
+                                              'tap p50', 'load p50', 'alloc/frame'))
+   for r in results:
+      print('%-20s %7d %9.2f %9.2f %9s %9s %11s'
+            % (r['screen'], r['frames'], r['frame_median_ms'], r['frame_max_ms'],
+               '%.2f' % r['tap_median_ms'] if 'tap_median_ms' in r else '-',
+               '%.2f' % r['load_median_ms'] if 'load_median_ms' in r else '-',
+               '%d B' % r['alloc_mean_bytes'] if 'alloc_mean_bytes' in r else '-'))
+   if 'scan' in timing.taps:
+      print('scan to item screen: %.2f ms median' % summary(timing.taps['scan'])['median_ms'])
+
+   missing = [name for name in SCREENS if name not in timing.frames]
+   with open(args.out, 'w') as f:
+      json.dump({'version': version(), 'python': platform.python_version(),
+                 'machine': platform.machine(), 'rounds': args.rounds, 'frames': timing.count,
+                 'fps': fps, 'missing': missing, 'results': results}, f, indent=1, sort_keys=True)
+   print('wrote ' + args.out)
+   app.data.close()
+   if missing:
+      print('screens never drawn: ' + ', '.join(missing))
+      sys.exit(1)
+
+if __name__ == '__main__':
+   main()
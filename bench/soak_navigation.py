@@ -0,0 +1,96 @@
+"""
+Headless navigation soak test for the Grocery Guard screens.
+Replays taps and barcode scans through the app's real screens, router, canvas and
+data executor on the dummy SDL driver, walking the navigation graph (menu bar
+jumps, list paging, recipe -> instructions -> back, scan confirmations, deletes
+and cooking). The camera, GPIO, speech and database are replaced by the stubs and
+in-memory data of bench_ui. Fails if the navigation stack or memory keeps growing.
+Usage: python bench/soak_navigation.py [navigations]
+"""
+
+from __future__ import print_function
+
+import gc
+import random
+import sys
+
+import pygame
+from pygame.locals import MOUSEBUTTONDOWN, MOUSEBUTTONUP
+
+from bench_ui import FakeData, setup
+
+try:
+   import tracemalloc
+except ImportError: # python 2, count objects instead
+   tracemalloc = None
+
+MAX_DEPTH = 4 # home -> recipes -> recipe -> instruction
+MAX_GROWTH = 512*1024 # bytes (or objects on python 2) allowed after warm up
+
+# screen -> taps (or 'scan') it reacts to
+GRAPH = {
+   'HomeScreen': [(160,50), (160,100), (160,150), 'scan'],
+   'FridgeScreen': [(50,220), (160,220), (270,220), (160,195), (305,30)],
+   'NotificationsScreen': [(50,220), (160,220), (270,220), (160,195)],
+   'RecipesScreen': [(50,220), (160,220), (270,220), (100,40), (100,68)],
+   'RecipeScreen': [(75,220), (250,220), (160,190)],
+   'InstructionScreen': [(160,220), (270,220), (50,220)],
+   'ItemAddedScreen': [(75,220), (250,220)],
+}
+
+def memory():
+   gc.collect()
+   if tracemalloc is not None:
+      return tracemalloc.get_traced_memory()[0]
+   return len(gc.get_objects())
+
+def main():
+   n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+   app = setup()
+   data = FakeData(app)
+   data.install()
+   router = app.router
+   rng = random.Random(0)
+   # peek() with no types loses the attributes of user events in pygame 2.6
+   types = [app.NOTIFY_EVENT, app.SCAN_EVENT, app.DATA_EVENT, app.UNPACK_EVENT,
+            MOUSEBUTTONDOWN, MOUSEBUTTONUP]
+
+   def settle():
+      # draw until the screen has its data and the queue is empty
+      while getattr(router.current, 'pending', None) is not None or pygame.event.peek(types):
+         router.dispatch(app.loop.events())
+
+   if tracemalloc is not None:
+      tracemalloc.start()
+   router.push(app.HomeScreen())
+   settle()
+
+   warmup = min(1000, n//10)
+   baseline = None
+   depth = 0
+   for i in range(n):
+      if i == warmup:
+         baseline = memory()
+      action = rng.choice(GRAPH[type(router.current).__name__])
+      if action == 'scan':
+         # mostly known products, sometimes a code that isn't in codes
+         app.scanner.scan(rng.choice(data.ids) if rng.random() < 0.9 else 1)
+      else:
+         for event_type in (MOUSEBUTTONDOWN, MOUSEBUTTONUP):
+            pygame.event.post(pygame.event.Event(event_type, pos=action, button=1))
+            router.dispatch(app.loop.events())
+      settle()
+      depth = max(depth, len(router.stack))
+   growth = memory() - baseline
+   app.data.close()
+
+   unit = 'bytes' if tracemalloc is not None else 'objects'
+   print('navigations: %d' % n)
+   print('deepest stack: %d' % depth)
+   print('growth after %d navigations: %d %s' % (warmup, growth, unit))
+   assert depth <= MAX_DEPTH, 'navigation stack grew to %d screens' % depth
+   assert growth < MAX_GROWTH, 'memory grew by %d %s' % (growth, unit)
+   print('ok')
+
+if __name__ == '__main__':
+   main()
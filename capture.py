@@ -0,0 +1,135 @@
+"""
+Background camera capture for the Grocery Guard.
+The webcam is opened once and a reader thread keeps the newest frames in a small
+ring buffer, so scan() can grab the latest frame without paying for camera
+initialization, start up, and settle time on every poll.
+"""
+
+import collections
+import threading
+import time
+
+class PygameFrameSource(object):
+   """
+   Frame source backed by pygame.camera.
+   devices is tried in order; sometimes the USB camera is detected at /dev/video0,
+   other times at /dev/video1.
+   """
+
+   def __init__(self, devices, res):
+      self.devices = devices
+      self.res = res
+      self.cam = None
+
+   def open(self):
+      import pygame.camera
+      pygame.camera.init()
+      error = None
+      for device in self.devices:
+         cam = pygame.camera.Camera(device, self.res, 'RGB')
+         try:
+            cam.start()
+         except Exception as e:
+            error = e
+            continue
+         self.cam = cam
+         return
+      raise error
+
+   def read(self):
+      return self.cam.get_image()
+
+   def close(self):
+      if self.cam is not None:
+         self.cam.stop()
+         self.cam = None
+
+class FakeFrameSource(object):
+   """
+   Frame source that replays a fixed list of frames in a loop. Needs no camera.
+   interval is the time in seconds between frames, to mimic a real device.
+   """
+
+   def __init__(self, frames, interval=0.0):
+      self.frames = list(frames)
+      self.interval = interval
+      self.index = 0
+      self.opened = False
+
+   def open(self):
+      self.opened = True
+
+   def read(self):
+      if self.interval:
+         time.sleep(self.interval)
+      frame = self.frames[self.index % len(self.frames)]
+      self.index += 1
+      return frame
+
+   def close(self):
+      self.opened = False
+
+class CaptureSession(object):
+   """
+   Long-lived capture session. Opens source once and reads frames on a daemon
+   thread into a ring buffer of the depth most recent frames.
+   """
+
+   def __init__(self, source, depth=3):
+      self.source = source
+      self.frames = collections.deque(maxlen=depth)
+      self.seq = 0 # number of frames captured so far
+      self.error = None # exception that stopped the reader thread, if any
+      self._cond = threading.Condition()
+      self._running = False
+      self._thread = None
+
+   def start(self):
+      """
+      Open the frame source and start the reader thread. Safe to call twice.
+      """
+      if self._running:
+         return
+      self.source.open()
+      self._running = True
+      self._thread = threading.Thread(target=self._run, name='capture')
+      self._thread.daemon = True
+      self._thread.start()
+
+   def stop(self):
+      """
+      Stop the reader thread and release the frame source.
+      """
+      self._running = False
+      if self._thread is not None:
+         self._thread.join(1.0)
+         self._thread = None
+      self.source.close()
+
+   def _run(self):
+      while self._running:
+         try:
+            frame = self.source.read()
+         except Exception as e:
+            self.error = e
+            self._running = False
+            break
+         with self._cond:
+            self.frames.append(frame)
+            self.seq += 1
+            self._cond.notify_all()
+      # wake anyone still waiting on a frame
+      with self._cond:
+         self._cond.notify_all()
+
+   def latest(self, timeout=None):
+      """
+      Return the newest captured frame, waiting up to timeout seconds for the first
+      one to arrive. Returns None if no frame is available.
+      """
+      with self._cond:
+         if not self.frames and self._running:
+            self._cond.wait(timeout)
+         if not self.frames:
+            return None
+         return self.frames[-1]
@@ -0,0 +1,107 @@
+"""
+Cache of the codes (UPC catalog) table for the Grocery Guard.
+Products are looked up by id (UPC) or by lower case name without a database
+round trip once they are cached. The cache is preloaded at startup, evicts the
+least recently used products beyond maxsize, and is refreshed from the database
+on a miss or after invalidate().
+"""
+
+import collections
+import threading
+
+class Catalog(object):
+   """
+   Bidirectional, LRU evicting cache of the codes table.
+      by_id(id)     -> (name, quantity, exp_days)
+      by_name(name) -> id
+   db is the Database to read codes from. maxsize is the largest number of
+   products kept in memory.
+   """
+
+   def __init__(self, db, maxsize=20000):
+      self.db = db
+      self.maxsize = maxsize
+      self._items = collections.OrderedDict() # id -> (name, quantity, exp_days), oldest first
+      self._names = {} # lower(name) -> id
+      self._lock = threading.Lock()
+
+   def load(self):
+      """
+      Preload up to maxsize products from the codes table.
+      """
+      with self.db.cursor() as cur:
+         cur.execute("select id,name,quantity,exp_days from codes limit %s", (self.maxsize,))
+         data = cur.fetchall()
+      with self._lock:
+         self._items.clear()
+         self._names.clear()
+         for row in data:
+            self._put(row)
+
+   def _put(self, row):
+      # cache one (id, name, quantity, exp_days) row as most recently used
+      id = int(row[0])
+      old = self._items.pop(id, None)
+      if old is not None:
+         self._names.pop(old[0].lower(), None)
+      self._items[id] = (row[1], row[2], row[3])
+      self._names[row[1].lower()] = id
+      while len(self._items) > self.maxsize:
+         evicted, item = self._items.popitem(last=False)
+         if self._names.get(item[0].lower()) == evicted:
+            del self._names[item[0].lower()]
+
+   def _touch(self, id):
+      # mark id as most recently used
+      item = self._items.pop(id)
+      self._items[id] = item
+      return item
+
+   def by_id(self, id):
+      """
+      (name, quantity, exp_days) of product id, or None if it isn't in codes.
+      """
+      id = int(id)
+      with self._lock:
+         if id in self._items:
+            return self._touch(id)
+      with self.db.cursor() as cur:
+         cur.execute("select id,name,quantity,exp_days from codes where id = %s", (id,))
+         row = cur.fetchone()
+      if row is None:
+         return None
+      with self._lock:
+         self._put(row)
+         return self._items[id]
+
+   def by_name(self, name):
+      """
+      id of the product called name (case insensitive), or None if it isn't in codes.
+      """
+      name = name.lower()
+      with self._lock:
+         id = self._names.get(name)
+         if id is not None:
+            self._touch(id)
+            return id
+      with self.db.cursor() as cur:
+         cur.execute("select id,name,quantity,exp_days from codes where name = %s", (name,))
+         row = cur.fetchone()
+      if row is None:
+         return None
+      with self._lock:
+         self._put(row)
+      return int(row[0])
+
+   def invalidate(self, id=None):
+      """
+      Forget product id, or every product if id is None. Call after codes changes.
+      """
+      with self._lock:
+         if id is None:
+            self._items.clear()
+            self._names.clear()
+            return
+         item = self._items.pop(int(id), None)
+         if item is not None and self._names.get(item[0].lower()) == int(id):
+            del self._names[item[0].lower()]
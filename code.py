@@ -8,7 +8,9 @@ Description: This code drives the front end user interface for the Grocery Guard
              the Raspberry Pi. Code should be run with no arguments on the Raspberry
              Pi device that contains the database. UI animation screens are under the 
              "User Interface Methods"section. Backend communication, set interpretation, 
-             and other helper methods are under the "Functional Methods" section.
+             and other helper methods are under the "Functional Methods" section. Importing the module has no
+             side effects; main() under "Bootstrap" brings up the display, camera,
+             GPIO and database.
 External packages used:
       - numpy
       - pygame
@@ -17,34 +19,37 @@ External packages used:
       - RPi.GPIO
 """
 
+from __future__ import print_function
 import os
+import functools
+import timeit
+import traceback
 import pygame
 from pygame.locals import *
-import pygame.camera
-import pygame.surfarray
 import numpy as np
-import zbar
-import zbar.misc
-import time
-import psycopg2
-import datetime
 from subprocess import call
-import RPi.GPIO as GPIO
-
-# Initialize Environment Variables for TFT
-os.putenv('SDL_VIDEODRIVER','fbcon')
-os.putenv('SDL_FBDEV','/dev/fb1')
-os.putenv('SDL_MOUSEDRV','TSLIB')
-os.putenv('SDL_MOUSEDEV','/dev/input/touchscreen')
-
-pygame.init()
-
-# Hide mouse on touchscreen
-pygame.mouse.set_visible(False)
-
+from capture import PygameFrameSource
+from scanner import ScannerProcess
+from db import Database, DSN, psycopg2_connect
+from recipes import RecipeMatrix, RecipeIndex, RecipeCache, stream_top
+from scheduler import ExpiryScheduler, expiry_message
+from catalog import Catalog
+from unpack import UnpackSession
+from render import Canvas
+from assets import Assets
+from loop import EventLoop
+from speech import Speaker
+from stats import Stats, instrumented
+from executor import DataExecutor
+from router import Router, Screen
 
 #Globals
 SIZE = WIDTH, HEIGHT = 320,240            #PiTFT Resolution
+# Environment Variables for TFT, set by init_display()
+DISPLAY_ENV = {'SDL_VIDEODRIVER':'fbcon',
+               'SDL_FBDEV':'/dev/fb1',
+               'SDL_MOUSEDRV':'TSLIB',
+               'SDL_MOUSEDEV':'/dev/input/touchscreen'}
 
 BLACK = [0, 0, 0]
 RED = [255, 0, 0]
@@ -52,581 +57,704 @@ GREEN = [0, 255, 0]
 BLUE = [0, 0, 255]
 WHITE = [255, 255, 255]
 
+STATS_FILE = os.environ.get('GROCERY_GUARD_STATS','/tmp/grocery_guard_stats.json') # metrics dump
+STATS_INTERVAL = 60 # seconds between metrics dumps
+STATS_OVERLAY = bool(os.environ.get('GROCERY_GUARD_OVERLAY')) # draw metrics over every screen
+metrics = Stats() # query, scan and frame timings of this run
+
 CAM_NAME='/dev/video0'
+CAM_FALLBACK='/dev/video1' # USB camera is sometimes detected here instead
 CAM_RES=(640,480)  # webcam resolution
 
-screen = pygame.display.set_mode(SIZE)
+SCAN_THRESHOLD = 4.0 # mean gray level change that counts as motion
+SCAN_FAST = 0.2 # scanning interval (s) right after motion
+SCAN_SLOW = 2.0 # longest scanning interval (s) when the scene is idle
+SCAN_REPEAT = 2.0 # seconds a code must be out of view before it is reported again
+scanner = None # ScannerProcess owning the camera, see get_scanner()
+
+screen = None # display surface, see init_display()
+canvas = None # Canvas drawing screens, pushing only the regions that change
+FPS = 30 # most frames per second drawn while events are coming in
+loop = None # EventLoop waiting for input and timer events
+router = None # Router holding the navigation stack of screens
+assets = Assets() # fonts, labels and icons shared by all screens, loaded at startup
 WINDOW = 62 #display margins for text alignement
 
-# Set up GPIO 27 as "bailout" to desktop
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(27, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+SPEECH_SYNTH = ['espeak','-s150','--stdout'] # writes the spoken text as WAV to stdout
+SPEECH_PLAY = ['aplay','-q'] # plays WAV from stdin
+speaker = Speaker(SPEECH_SYNTH,SPEECH_PLAY) # reads recipe steps aloud, caching the audio
+
+# static labels pre-rendered at startup, as (font size, text, color)
+LABELS = ([(40,text,WHITE) for text in ('Display Items','Suggest Recipes','Notifications')] +
+          [(20,text,WHITE) for text in ('Menu','Suggest Recipes','Notifications','Display Items',
+                                        'Unpack','Show Instructions','Back to Recipes',
+                                        'Back to Recipe','Next Step','Previous Step',
+                                        'Incorrect?','Correct?','COOK!','COOKED!',
+                                        'Loading...')] +
+          [(20,'Toggle Speech',RED),(20,'Toggle Speech',GREEN),(20,'Could not load',RED)])
+
+# record layout of the ingredients array returned by get_ingredients()
+FRIDGE_DTYPE = np.dtype([('id',np.int64),('name',object),('quantity',np.int64),('days',np.int64)])
+# record layout of the notifications array returned by get_notifications()
+NOTIFY_DTYPE = np.dtype([('id',np.int64),('name',object),('message',object),('expired',bool)])
+
+EXP_DAYS = 5 #number of days til expiration to trigger notification
+ING_LOW = 5 #number of ingredient units to trigger notification
+
+NOTIFY_EVENT = USEREVENT+1 # posted with .count when the notifications change
+SCAN_EVENT = USEREVENT+2 # posted with .upc and .quality when the scanner decodes a barcode
+DATA_EVENT = USEREVENT+3 # posted with .request when a data executor request finishes
+expiry = None # ExpiryScheduler caching the notifications, see start_expiry_scheduler()
+
+UNPACK_ITEMS = 20 # queued scans that force a write during an unpacking session
+UNPACK_AGE = 60 # seconds a scan may stay queued during an unpacking session
+unpacking = None # UnpackSession while the user is unpacking groceries
+UNPACK_EVENT = USEREVENT+4 # timer event, checks the unpacking session's age limit
+UNPACK_POLL = 5 # seconds between unpacking session checks
+
+# indexes backing the notifications query (expiry date and quantity)
+FRIDGE_INDEXES = ["create index if not exists fridge_expires on fridge ((added+exp_days))",
+                  "create index if not exists fridge_quantity on fridge (quantity)"]
+
+db = Database(DSN,connect=instrumented(psycopg2_connect,metrics)) # pooled connections to the Postgres back end
+catalog = Catalog(db) # cache of the codes table, preloaded at startup
+data = DataExecutor(DATA_EVENT) # runs database calls off the UI thread
+recipe_cache = RecipeCache(db) # details of recently viewed recipes
+recipe_index = None # RecipeIndex of recipe scores, loaded on first use
+NUM_REC = 5 #number of recipes to suggest
+RECIPE_STREAMING = False # stream the recipes table instead of caching it (large catalogs)
+RECIPE_BATCH = 500 # recipes fetched per batch when streaming
+
+# GPIO 27 is the "bailout" to desktop, see init_gpio()
 def GPIO27_callback(channel):
    cmd = 'startx'
    call(cmd, shell=True)
 
-# Add threaded callback interrupt for GPIO 27
-GPIO.add_event_detect(27,GPIO.FALLING,callback=GPIO27_callback,bouncetime=300)
-
 # --------------- User Interface Methods ---------------- #
 
-def home_screen():
+def power_icon():
    """
-   Animates the home screen for the Grocery Guard. Called on startup.
-   Continuously polls scan() to see if barcode detected.
-   Links to display_notifications, display_fridge, and display_recipes.
-   Power button in bottom right shuts down the pi.
+   Draws the power button shown in the bottom right of the home screen.
    """
+   icon = pygame.Surface((31,33), SRCALPHA)
+   pygame.draw.circle(icon, RED, [15,17],15)
+   pygame.draw.circle(icon, WHITE, [15,17],12,2)
+   pygame.draw.rect(icon, WHITE, (14,0,2,14))
+   return icon
 
-   my_font = pygame.font.Font(None,40)
-   my_buttons = {'Display Items':(WIDTH/2,50),
-               'Suggest Recipes':(WIDTH/2,100),
-               'Notifications':(WIDTH/2,150)}
-
-   pos = (0,0) # mouse position on click
-
-   start_time = time.time()
-   delay = 100 # barcode scanning interval
-
-   # animate and get events
-   while True:
-      # mouse/touchscreen input
-      for event in pygame.event.get():
-         if(event.type is MOUSEBUTTONDOWN):
-            pos=pygame.mouse.get_pos()
-         # detect mouse clicks (trigger event when mouse released)
-         elif(event.type is MOUSEBUTTONUP):
-            pos=pygame.mouse.get_pos()
-            x,y=pos
-            #power button
-            if y>210:
-               if x>290:
-                  # shut down the pi
-                  cmd = 'sudo shutdown -h now'
-                  call(cmd, shell=True)
-            #Display Items
-            elif 25<y<75:
-               ingredients = get_ingredients()
-               display_fridge(ingredients,0)
-            #Suggest Recipes
-            elif 75<y<125:
-               recipes = get_recipes()
-               display_recipes(recipes)
-            #Display Notifications
-            elif 125<y<175:
-               ingredients = get_ingredients()
-               notifications = get_notifications(ingredients)
-               display_notifications(notifications,0)
+def draw_stats_overlay(canvas):
+   """
+   Debug overlay in the bottom left corner: the current screen's 95th percentile
+   frame time and the number of queries run so far.
+   """
+   name = type(router.current).__name__
+   frame = metrics.histogram('frame: ' + name)
+   text = name + ' p95 ' + str(int(frame.percentile(95)) if frame else 0) + 'ms, ' + \
+          str(metrics.calls('sql: ')) + ' queries'
+   canvas.text(assets.font(20), text, GREEN, bottomleft=(0,HEIGHT))
 
-      screen.fill(BLACK) # Erase the Work space
+class DataScreen(Screen):
+   """
+   Screen that loads its data through the data executor instead of querying in
+   the event handler. Subclasses call request(fn,*args) and get the result in
+   loaded(result) when its DATA_EVENT arrives. If the call raised, failed(error)
+   is called instead and the screen shows an error where its data would be; the
+   menu buttons still work, and entering the screen again retries. Pending
+   requests are cancelled when the screen is left.
+   """
+
+   pending = None # Request whose result the screen is waiting for
+   error = None # exception raised by the last request, if it failed
+
+   def request(self, fn, *args):
+      data.cancel(self)
+      self.pending = data.submit(self, fn, *args)
+
+   def loaded(self, result):
+      pass
+
+   def failed(self, error):
+      self.error = error
+
+   def exit(self):
+      data.cancel(self)
+      self.pending = None
+
+   def handle_event(self, event):
+      """
+      Hand this screen's results to loaded(). Returns True if event was a DATA_EVENT.
+      """
+      if(event.type != DATA_EVENT):
+         return False
+      if event.request is self.pending:
+         self.pending = None
+         if event.request.error is not None:
+            self.failed(event.request.error)
+         else:
+            self.error = None
+            self.loaded(event.request.result)
+      return True
+
+   def render_loading(self, canvas):
+      if self.error is not None:
+         canvas.image(assets.label(20, 'Could not load', RED), center=(WIDTH/2,HEIGHT/2))
+      else:
+         canvas.image(assets.label(20, 'Loading...', WHITE), center=(WIDTH/2,HEIGHT/2))
+
+class HomeScreen(Screen):
+   """
+   Animates the home screen for the Grocery Guard. Root of the router's stack.
+   Opens ItemAddedScreen when the scanner process posts a SCAN_EVENT.
+   Links to NotificationsScreen, FridgeScreen, and RecipesScreen.
+   Unpack button in bottom left toggles a grocery unpacking session, in which
+   confirmed scans are queued and written to the Fridge together.
+   Power button in bottom right shuts down the pi.
+   """
 
+   def __init__(self):
+      self.my_font2 = assets.font(20)
+      self.my_buttons = {'Display Items':(WIDTH/2,50),
+                  'Suggest Recipes':(WIDTH/2,100),
+                  'Notifications':(WIDTH/2,150)}
+      self.badge = 0 # number of notifications
+
+   def enter(self):
+      self.badge = expiry.count if expiry is not None else 0
+      # decode barcodes while on this screen (the scanner starts after the first frame)
+      if scanner is not None:
+         scanner.resume()
+
+   def exit(self):
+      if scanner is not None:
+         scanner.pause()
+
+   def handle_event(self, event):
+      global unpacking
+      # detect mouse clicks (trigger event when mouse released)
+      if(event.type == MOUSEBUTTONUP):
+         x,y=event.pos
+         #power button
+         if y>210:
+            if x>290:
+               # shut down the pi, after writing any scans the session still holds
+               if unpacking is not None:
+                  loop.set_timer(UNPACK_EVENT,0)
+                  unpacking.close()
+                  unpacking = None
+               data.close()
+               cmd = 'sudo shutdown -h now'
+               call(cmd, shell=True)
+            #unpacking session
+            elif x<100:
+               if unpacking is None:
+                  unpacking = start_unpacking()
+                  loop.set_timer(UNPACK_EVENT,UNPACK_POLL)
+               else:
+                  loop.set_timer(UNPACK_EVENT,0)
+                  unpacking.close()
+                  unpacking = None
+         #Display Items
+         elif 25<y<75:
+            self.router.push(FridgeScreen(0))
+         #Suggest Recipes
+         elif 75<y<125:
+            self.router.push(RecipesScreen())
+         #Display Notifications
+         elif 125<y<175:
+            self.router.push(NotificationsScreen(0))
+      # notifications changed in the background
+      elif(event.type == NOTIFY_EVENT):
+         self.badge = event.count
+      # barcode decoded by the scanner process
+      elif(event.type == SCAN_EVENT):
+         print(str(event.upc) + " scanned, quality " + str(event.quality))
+         self.router.push(ItemAddedScreen(event.upc))
+
+   def render(self, canvas):
       #write text to screen
-      for my_text,text_pos in my_buttons.items():
-         text_surface = my_font.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         screen.blit(text_surface,text_rect)
+      for my_text,text_pos in self.my_buttons.items():
+         canvas.image(assets.label(40, my_text, WHITE), center=text_pos)
 
       # draw power button
-      pygame.draw.circle(screen, RED, [WIDTH-15,HEIGHT-15],15)
-      pygame.draw.circle(screen, WHITE, [WIDTH-15,HEIGHT-15],12,2)
-      pygame.draw.rect(screen, WHITE, (WIDTH-16,HEIGHT-32,2,14))
-      
-      pygame.display.flip() # display workspace on screen
-      
-      # poll scan() for barcode hits
-      if delay == 0:
-         id = scan()
-         if id > 0:
-            print str(id) + " scanned"
-            item = get_item_name(id)
-            print item, type(item)
-            display_item_added(item,id)
-         # reset scanning interval timer
-         delay = 100
-         start_time=time.time()
-      
-      delay -= 1
-
-def display_fridge(ingredients,starti):
-   """
-   Animates and displays the contents currently contained in the 'Fridge.' These items 
+      canvas.image(assets.icon('power'), bottomright=(WIDTH+1,HEIGHT+1))
+
+      # draw notification count badge
+      if self.badge > 0:
+         canvas.circle(RED, [WIDTH-35,150],12)
+         canvas.text(self.my_font2, str(self.badge), WHITE, center=(WIDTH-35,150))
+
+      # draw unpacking session button
+      if unpacking is None:
+         canvas.image(assets.label(20, 'Unpack', WHITE), center=(50,220))
+      else:
+         canvas.text(self.my_font2, 'Done (' + str(len(unpacking.queue)) + ')', GREEN, center=(50,220))
+
+class FridgeScreen(DataScreen):
+   """
+   Animates and displays the contents currently contained in the 'Fridge.' These items
    are scanned in using the barcode scanner.
-   ingredients must be formatted as a numpy array:
-      ingredients = np.asarray([ing1,ing2,ing3,...])
-      where ingi = "Name amt+unit time to expire in days"
    starti is the index of ingredients from which to begin displaying
+   ingredients is a numpy structured array of FRIDGE_DTYPE records, as returned by
+   get_ingredients(). If None, it is loaded when the screen is entered.
    User may delete expired ingredients in their Fridge from this screen.
-   Links to home_screen(), display_notifications(), display_recipes()
+   Links to HomeScreen, NotificationsScreen, RecipesScreen
    """
-   
-   my_font = pygame.font.Font(None,30)
-   my_font2 = pygame.font.Font(None,20)
-
-   # text display dictionaries
-   ing_list = {}
-   amt_list={}
-   exp_list={}
-   circle_list = {}
-   text_list={"Item                 Amount      Expiring in":((WIDTH/2),10)}
-   text_list["-"*WINDOW]=((WIDTH/2),20)
+
    NUM_ING = 8 #number of ingredient to display per screen
 
-   # add each of the NUM_ING ingredients to the list
-   # add ingredients[starti:starti+NUM_ING]
-   for i in range(min(ingredients.shape[0]-starti,NUM_ING)):
-      #parse ingredient
-      tmp = ingredients[starti+i]
-      tmp_list = tmp.split()
-      
-      # for all text-based dictionaries, entries are appended with a unique
-      # number of whitespaces to make each key unique
-      # structure of entries is dict["text to display"] = (posx, posy)
-      ing_list[" ".join(tmp_list[:-4]) + " "*(i+1)] = ((WIDTH/2),30+20*i)
-      amt_list[tmp_list[-4] + " "*(i+1)] = ((WIDTH/2),30+20*i)
-      exp_list[tmp_list[-3] + " days" + " "*(i+1)] = ((WIDTH/2),30+20*i)
-
-      # if ingredient expired, draw circle at its position
-      if float(tmp_list[-3]) < 0:
-         circle_list[" ".join(tmp_list[:-4])+ " "*(i+1)] = ((WIDTH-15),30+20*i)
-      
-   # determine if there are more ingredients to display after/before this screen
-   more = True if ingredients.shape[0]-starti > NUM_ING else False
-   prev = True if starti > NUM_ING-1 else False
-   # add buttons accordingly
-   if more:
-      ing_list['More Ingredients'] = ((WIDTH/2),10+20*(NUM_ING+1)+5)
-   elif prev:
-      ing_list['Previous'] = ((WIDTH/2),10+20*(NUM_ING+1)+5)
-
-   # add static buttons
-   my_buttons = {'Menu':(50,220),
-               'Suggest Recipes':(160,220),
-               'Notifications':(270,220)}
-
-   # position of mouse click
-   pos = (0,0) 
-   
-   # animate and get events
-   while True:
-      #mouse/touchscreen input
-      for event in pygame.event.get():
-         if(event.type is MOUSEBUTTONDOWN):
-            pos=pygame.mouse.get_pos()
-         elif(event.type is MOUSEBUTTONUP):
-            pos=pygame.mouse.get_pos()
-            x,y=pos
-            #check if circle clicked
-            if x > WIDTH-50:
-               for ing,pos in circle_list.items():
-                  if pos[1]-15 < y < pos[1]+15:
-                     #print "deleting " + ing
-                     # delete item from Fridge
-                     id = get_item_id(ing.strip())
-                     update_fridge(id,0) # when 0 passed as arg[1], update_fridge deletes
-                     #refresh ingredient list and display at same start index
-                     new_ingredients = get_ingredients()
-                     display_fridge(new_ingredients,starti)
-            #more ingredients
-            if 185<y<205:
-               if more:
-                  # display ingredients starti + NUM_ING thru starti + 2*NUM_ING-1
-                  display_fridge(ingredients,starti+NUM_ING)
-               elif prev:
-                  # display ingredients starti-NUM_ING thru starti-1
-                  display_fridge(ingredients,starti-NUM_ING)
-
-            #Display static buttons
-            if y>210:
-               # back to menu
-               if x<75:
-                  home_screen()
-               # Suggest Recipes
-               elif 100<x<225:
-                  recipes = get_recipes()
-                  display_recipes(recipes)
-               #Display Notifications
-               elif x>230:
-                  notifications = get_notifications(ingredients)
-                  display_notifications(notifications,0)
-
-      screen.fill(BLACK) # Erase the Work space
+   def __init__(self, starti, ingredients=None):
+      self.starti = starti
+      self.ingredients = None
+
+      self.my_font2 = assets.font(20)
+
+      # text display dictionaries
+      self.ing_list = {}
+      self.amt_list = {}
+      self.exp_list = {}
+      self.circle_list = {}
+      self.text_list = {"Item                 Amount      Expiring in":((WIDTH/2),10)}
+      self.text_list["-"*WINDOW]=((WIDTH/2),20)
+      self.more = False
+      self.prev = False
+
+      # add static buttons
+      self.my_buttons = {'Menu':(50,220),
+                  'Suggest Recipes':(160,220),
+                  'Notifications':(270,220)}
+
+      if ingredients is not None:
+         self.loaded(ingredients)
+
+   def enter(self):
+      if self.ingredients is None:
+         self.request(get_ingredients)
+
+   def loaded(self, ingredients):
+      self.ingredients = ingredients
+      starti = self.starti
+      NUM_ING = self.NUM_ING
+      self.ing_list = ing_list = {}
+      self.amt_list = amt_list = {}
+      self.exp_list = exp_list = {}
+      self.circle_list = circle_list = {}
+
+      # add each of the NUM_ING ingredients to the list
+      # add ingredients[starti:starti+NUM_ING]
+      for i in range(min(ingredients.shape[0]-starti,NUM_ING)):
+         ing = ingredients[starti+i]
+
+         # for all text-based dictionaries, entries are appended with a unique
+         # number of whitespaces to make each key unique
+         # structure of entries is dict["text to display"] = (posx, posy)
+         ing_list[ing['name'] + " "*(i+1)] = ((WIDTH/2),30+20*i)
+         amt_list[str(ing['quantity']) + " "*(i+1)] = ((WIDTH/2),30+20*i)
+         exp_list[str(ing['days']) + " days" + " "*(i+1)] = ((WIDTH/2),30+20*i)
+
+         # if ingredient expired, draw circle at its position
+         # structure of entries is circle_list[item id] = (posx, posy)
+         if ing['days'] < 0:
+            circle_list[ing['id']] = ((WIDTH-15),30+20*i)
+
+      # determine if there are more ingredients to display after/before this screen
+      self.more = True if ingredients.shape[0]-starti > NUM_ING else False
+      self.prev = True if starti > NUM_ING-1 else False
+      # add buttons accordingly
+      if self.more:
+         ing_list['More Ingredients'] = ((WIDTH/2),10+20*(NUM_ING+1)+5)
+      elif self.prev:
+         ing_list['Previous'] = ((WIDTH/2),10+20*(NUM_ING+1)+5)
+
+   def handle_event(self, event):
+      if super(FridgeScreen,self).handle_event(event):
+         return
+      if(event.type == MOUSEBUTTONUP):
+         x,y=event.pos
+         #check if circle clicked
+         if x > WIDTH-50:
+            for id,pos in self.circle_list.items():
+               if pos[1]-15 < y < pos[1]+15:
+                  #print "deleting ", id
+                  # delete item from Fridge
+                  data.submit(None,update_fridge,id,0) # when 0 passed as arg[1], update_fridge deletes
+                  #refresh ingredient list and display at same start index
+                  self.request(get_ingredients)
+                  return
+         #more ingredients
+         if 185<y<205:
+            if self.more:
+               # display ingredients starti + NUM_ING thru starti + 2*NUM_ING-1
+               self.router.replace(FridgeScreen(self.starti+self.NUM_ING,self.ingredients))
+            elif self.prev:
+               # display ingredients starti-NUM_ING thru starti-1
+               self.router.replace(FridgeScreen(self.starti-self.NUM_ING,self.ingredients))
+
+         #Display static buttons
+         elif y>210:
+            # back to menu
+            if x<75:
+               self.router.home()
+            # Suggest Recipes
+            elif 100<x<225:
+               self.router.switch(RecipesScreen())
+            #Display Notifications
+            elif x>230:
+               self.router.switch(NotificationsScreen(0,ingredients=self.ingredients))
+
+   def render(self, canvas):
+      my_font2 = self.my_font2
 
       # display text items
-      for my_text,text_pos in text_list.items():
-         text_surface = my_font2.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         text_rect.left = 50
-         screen.blit(text_surface,text_rect)
-
-      for my_text,text_pos in my_buttons.items():
-         text_surface = my_font2.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         screen.blit(text_surface,text_rect)
-
-      for my_text,text_pos in ing_list.items():
-         text_surface = my_font2.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         text_rect.left = 50
-         screen.blit(text_surface,text_rect)
-
-      for my_text,text_pos in amt_list.items():
-         text_surface = my_font2.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         text_rect.left = 170
-         screen.blit(text_surface,text_rect)
-
-      for my_text,text_pos in exp_list.items():
-         text_surface = my_font2.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         text_rect.left = 225
-         screen.blit(text_surface,text_rect)
-      #draw circles
-      for index,pos in circle_list.items():
-         pygame.draw.circle(screen, RED, pos,10)
+      for my_text,text_pos in self.text_list.items():
+         canvas.text(my_font2, my_text, WHITE, centery=text_pos[1], left=50)
+
+      for my_text,text_pos in self.my_buttons.items():
+         canvas.image(assets.label(20, my_text, WHITE), center=text_pos)
+
+      if self.ingredients is None:
+         self.render_loading(canvas)
+         return
+
+      for my_text,text_pos in self.ing_list.items():
+         canvas.text(my_font2, my_text, WHITE, centery=text_pos[1], left=50)
+
+      for my_text,text_pos in self.amt_list.items():
+         canvas.text(my_font2, my_text, WHITE, centery=text_pos[1], left=170)
 
-      pygame.display.flip()
+      for my_text,text_pos in self.exp_list.items():
+         canvas.text(my_font2, my_text, WHITE, centery=text_pos[1], left=225)
+      #draw circles
+      for index,pos in self.circle_list.items():
+         canvas.circle(RED, pos,10)
 
-def display_recipes(recipes):
+class RecipesScreen(DataScreen):
    """
-   Animates and displays the suggested recipes. This list is determined by the 
-   get_recipes() function.
+   Animates and displays the suggested recipes. This list is determined by the
+   get_recipes() function, which is called when the screen is entered.
    recipes is formatted as a numpy array
       recipes = np.asarray([rec1,rec2,...],[id1,id2,...])
       where reci = 'name %match'
       %match = (#ing in fridge used by recipe)/(# total ing used by recipe)
+   One row per suggested recipe (NUM_REC), spread between ROW_TOP and ROW_BOTTOM.
    """
-   # parse recipes
-   ids = recipes[1]
-   recipes = recipes[0]
 
-   text_list={"Recipe                          Percent Match":((WIDTH/2),10)}
-   text_list["-"*WINDOW]=((WIDTH/2),20)
-   
-   my_font = pygame.font.Font(None,25)
-   my_font2 = pygame.font.Font(None,20)
-   rec_list = {}
-   match_list = {}
-   
-   # dictionary of recipes unsorted_dict[recipe name] = %match
-   unsorted_dict = {}
-   for i in range(5):
-      tmp = recipes[i]
-      tmp_list = tmp.split()
-      match = float(tmp_list[-1])*100
-      var = ' '.join(tmp_list[:-1])
-      unsorted_dict[var] = (match,ids[i])
-
-   # sort the dictionary by %match
-   sorted_list = sorted(unsorted_dict, key=unsorted_dict.get, reverse=True)
-   
-   i = 0 # index used to create unique keys
-   # add elements of sorted_list to rec_list and match_list in order
-   for ing in sorted_list:
-      match = float(unsorted_dict[ing][0])
-      if match >= 100:
-         match_str = str(match)[:3]
-      else:
-         match_str = str(match)[:2]
-      var = ing
-      # if text too long, crop
-      if len(var) > 18:
-         var = var[:16] + '...'
-      rec_list[var + " "*(i+1)] = ((WIDTH/2),35+33*i)
-      match_list[match_str + "%"  + " "*(i+1)] = ((WIDTH/2),35+33*i)
-      i+=1
-
-   # static buttons
-   my_buttons = {'Menu':(50,220),
-               'Display Items':(160,220),
-               'Notifications':(270,220)}
-
-   # mouse position
-   pos = (0,0) 
-   
-   # animate and get events
-   while True:
-      #mouse/touchscreen input
-      for event in pygame.event.get():
-         if(event.type is MOUSEBUTTONDOWN):
-            pos=pygame.mouse.get_pos()
-         elif(event.type is MOUSEBUTTONUP):
-            pos=pygame.mouse.get_pos()
-            x,y=pos
-            #go to specific recipe screen
-            if x>50:
-               if 30<y<45:
-                  # get appropriate recipe id 
-                  display_single_recipe(unsorted_dict[sorted_list[0]][1])
-               elif 55<y<80:
-                  display_single_recipe(unsorted_dict[sorted_list[1]][1])
-               elif 90<y<115:
-                  display_single_recipe(unsorted_dict[sorted_list[2]][1])
-               elif 120<y<145:
-                  display_single_recipe(unsorted_dict[sorted_list[3]][1])
-               elif 155<y<180:
-                  display_single_recipe(unsorted_dict[sorted_list[4]][1])
-            # Static buttons
-            if y>210:
-               #back to menu   
-               if x<75:
-                  home_screen()
-               #Display Fridge
-               elif 115<x<210:
-                  ingredients = get_ingredients()
-                  display_fridge(ingredients,0)
-               #Display Notifications
-               elif x>230:
-                  ingredients = get_ingredients()
-                  notifications = get_notifications(ingredients)
-                  display_notifications(notifications,0)
-
-      screen.fill(BLACK) # Erase the Work space
+   ROW_TOP = 35 # center of the first recipe row
+   ROW_BOTTOM = 200 # rows stay above the menu bar
+
+   def __init__(self):
+      self.recipes = None
+      # distance between recipe rows, 33 for the default of 5 recipes
+      self.pitch = min(33, (self.ROW_BOTTOM-self.ROW_TOP)//max(NUM_REC,1))
+
+      self.text_list={"Recipe                          Percent Match":((WIDTH/2),10)}
+      self.text_list["-"*WINDOW]=((WIDTH/2),20)
+
+      self.my_font = assets.font(25)
+      self.my_font2 = assets.font(20)
+      self.rec_list = {}
+      self.match_list = {}
+      self.rec_ids = [] # recipe ids in display order
+
+      # static buttons
+      self.my_buttons = {'Menu':(50,220),
+                  'Display Items':(160,220),
+                  'Notifications':(270,220)}
+
+   def enter(self):
+      if self.recipes is None:
+         self.request(get_recipes)
+
+   def loaded(self, recipes):
+      self.recipes = recipes
+      # parse recipes
+      ids = recipes[1]
+      recipes = recipes[0]
+
+      # load the suggested recipes' details in the background so opening one is instant
+      recipe_cache.prefetch([int(float(id)) for id in ids if int(float(id)) > 0])
+
+      self.rec_list = rec_list = {}
+      self.match_list = match_list = {}
+
+      # dictionary of recipes unsorted_dict[recipe name] = %match
+      unsorted_dict = {}
+      for i in range(min(NUM_REC,len(recipes))):
+         tmp = recipes[i]
+         tmp_list = tmp.split()
+         match = float(tmp_list[-1])*100
+         var = ' '.join(tmp_list[:-1])
+         unsorted_dict[var] = (match,ids[i])
+
+      # sort the dictionary by %match
+      sorted_list = sorted(unsorted_dict, key=unsorted_dict.get, reverse=True)
+      self.rec_ids = [unsorted_dict[rec][1] for rec in sorted_list]
+
+      i = 0 # index used to create unique keys
+      # add elements of sorted_list to rec_list and match_list in order
+      for ing in sorted_list:
+         match = float(unsorted_dict[ing][0])
+         if match >= 100:
+            match_str = str(match)[:3]
+         else:
+            match_str = str(match)[:2]
+         var = ing
+         # if text too long, crop
+         if len(var) > 18:
+            var = var[:16] + '...'
+         rec_list[var + " "*(i+1)] = ((WIDTH/2),self.ROW_TOP+self.pitch*i)
+         match_list[match_str + "%"  + " "*(i+1)] = ((WIDTH/2),self.ROW_TOP+self.pitch*i)
+         i+=1
+
+   def handle_event(self, event):
+      if super(RecipesScreen,self).handle_event(event):
+         return
+      if(event.type == MOUSEBUTTONUP):
+         x,y=event.pos
+         #go to specific recipe screen
+         if x>50 and y < self.ROW_TOP+self.pitch*len(self.rec_ids):
+            # row whose band (pitch high, centered on the row) holds y
+            i = int((y-self.ROW_TOP+self.pitch/2.0)//self.pitch)
+            # rows padding the list up to NUM_REC have id 0
+            if 0 <= i < len(self.rec_ids) and int(float(self.rec_ids[i])) > 0:
+               # get appropriate recipe id
+               self.router.push(RecipeScreen(self.rec_ids[i]))
+               return
+         # Static buttons
+         if y>210:
+            #back to menu
+            if x<75:
+               self.router.home()
+            #Display Fridge
+            elif 115<x<210:
+               self.router.switch(FridgeScreen(0))
+            #Display Notifications
+            elif x>230:
+               self.router.switch(NotificationsScreen(0))
+
+   def render(self, canvas):
       # write text
-      for my_text,text_pos in my_buttons.items():
-         text_surface = my_font2.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         screen.blit(text_surface,text_rect)
+      for my_text,text_pos in self.my_buttons.items():
+         canvas.image(assets.label(20, my_text, WHITE), center=text_pos)
 
-      for my_text,text_pos in rec_list.items():
-         text_surface = my_font.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         text_rect.left = 50
-         screen.blit(text_surface,text_rect)
+      for my_text,text_pos in self.text_list.items():
+         canvas.text(self.my_font2, my_text, WHITE, centery=text_pos[1], left=50)
 
-      for my_text,text_pos in match_list.items():
-         text_surface = my_font.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         text_rect.left = 230
-         screen.blit(text_surface,text_rect)
+      if self.recipes is None:
+         self.render_loading(canvas)
+         return
 
-      for my_text,text_pos in text_list.items():
-         text_surface = my_font2.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         text_rect.left = 50
-         screen.blit(text_surface,text_rect)
+      for my_text,text_pos in self.rec_list.items():
+         canvas.text(self.my_font, my_text, WHITE, centery=text_pos[1], left=50)
 
-      pygame.display.flip()
+      for my_text,text_pos in self.match_list.items():
+         canvas.text(self.my_font, my_text, WHITE, centery=text_pos[1], left=230)
 
-def display_notifications(notifications, starti):
+class NotificationsScreen(DataScreen):
    """
    Animates and displays the notifications screen. Notifications come from get_notifications()
-   notifications is formatted as a numpy array
-      notifications = np.asarray([not1,not2,...])
-      where noti = "ingredient;message"
    starti is the starting index of notifications from which to display on this screen
+   notifications is a numpy structured array of NOTIFY_DTYPE records, as returned by
+   get_notifications(). If None, it is loaded when the screen is entered, from
+   ingredients if given.
    """
-   
-   my_font = pygame.font.Font(None,30)
-   my_font2 = pygame.font.Font(None,20)
-
-   text_list={"Item                 Message":((WIDTH/2),10)}
-   text_list["-"*WINDOW]=((WIDTH/2),20)
-   ing_list = {}
-   not_list = {}
-   circle_list = {}
+
    NUM_NOT = 8 #number of notifications to display per screen
-   # parse notifcations and add to text lists
-   for i in range(min(notifications.shape[0]-starti,NUM_NOT)):
-      tmp = notifications[starti+i]
-      tmp_list = tmp.split(";")
-      ing_list[tmp_list[0]+" "*(i+1)] = ((WIDTH/2),30+20*i)
-      not_list[tmp_list[1]+" "*(i+1)] = ((WIDTH/2),30+20*i)
-      # if ingredient expired, draw a circle next to it
-      if tmp_list[1][:7] == "expired":
-         circle_list[tmp_list[0]+" "*(i+1)] = ((WIDTH-30),30+20*i)
-   
-   # determine if more notifications exist on next/prev screen
-   more = True if notifications.shape[0]-starti > NUM_NOT else False
-   prev = True if starti > NUM_NOT-1 else False
-   # and add appropriate buttons
-   if more:
-      ing_list['More notifications'] = ((WIDTH/2),10+20*(NUM_NOT+1)+5)
-   elif prev:
-      ing_list['Previous'] = ((WIDTH/2),10+20*(NUM_NOT+1)+5)
-
-   # add static buttons
-   my_buttons = {'Menu':(50,220),
-               'Suggest Recipes':(160,220),
-               'Display Items':(270,220)}
-
-   pos = (0,0) 
-   
-   # animate and get events
-   while True:
-      #mouse/touchscreen input
-      for event in pygame.event.get():
-         if(event.type is MOUSEBUTTONDOWN):
-            pos=pygame.mouse.get_pos()
-         elif(event.type is MOUSEBUTTONUP):
-            pos=pygame.mouse.get_pos()
-            x,y=pos
-            #check if circle clicked
-            if x > WIDTH-50:
-               for ing,pos in circle_list.items():
-                  if pos[1]-15 < y < pos[1]+15:
-                     #print "deleting ", ing
-                     # delete item from fridge
-                     id = get_item_id(ing.strip())
-                     update_fridge(id,0)
-                     # refresh ingredients list
-                     new_ingredients = get_ingredients()
-                     new_notifications = get_notifications(new_ingredients)
-                     display_notifications(new_notifications,starti)
-            #more notifications
-            if 185<y<205:
-               if more:
-                  # display notifications starti + NUM_NOT thru starti + 2*NUM_NOT-1
-                  display_notifications(notifications,starti+NUM_NOT)
-               elif prev:
-                  # display notifications starti-NUM_NOT thru starti-1
-                  display_notifications(notifications,starti-NUM_NOT)
-            #Display Items
-            if y>210:
-               #back to menu   
-               if x<75:
-                  home_screen()
-               #Suggest Recipes
-               elif 100<x<225:
-                  recipes = get_recipes()
-                  display_recipes(recipes)
-               #Display Fridge
-               elif x>230:
-                  ingredients = get_ingredients()
-                  display_fridge(ingredients,0)
-
-      screen.fill(BLACK) # Erase the Work space
-      
+
+   def __init__(self, starti, notifications=None, ingredients=None):
+      self.starti = starti
+      self.notifications = None
+      self.ingredients = ingredients
+
+      self.my_font2 = assets.font(20)
+
+      self.text_list={"Item                 Message":((WIDTH/2),10)}
+      self.text_list["-"*WINDOW]=((WIDTH/2),20)
+      self.ing_list = {}
+      self.not_list = {}
+      self.circle_list = {}
+      self.more = False
+      self.prev = False
+
+      # add static buttons
+      self.my_buttons = {'Menu':(50,220),
+                  'Suggest Recipes':(160,220),
+                  'Display Items':(270,220)}
+
+      if notifications is not None:
+         self.loaded(notifications)
+
+   def enter(self):
+      if self.notifications is None:
+         self.request(get_notifications,self.ingredients)
+
+   def loaded(self, notifications):
+      self.notifications = notifications
+      self.ingredients = None
+      starti = self.starti
+      NUM_NOT = self.NUM_NOT
+      self.ing_list = ing_list = {}
+      self.not_list = not_list = {}
+      self.circle_list = circle_list = {}
+      # parse notifcations and add to text lists
+      for i in range(min(notifications.shape[0]-starti,NUM_NOT)):
+         note = notifications[starti+i]
+         ing_list[note['name']+" "*(i+1)] = ((WIDTH/2),30+20*i)
+         not_list[note['message']+" "*(i+1)] = ((WIDTH/2),30+20*i)
+         # if ingredient expired, draw a circle next to it
+         # structure of entries is circle_list[item id] = (posx, posy)
+         if note['expired']:
+            circle_list[note['id']] = ((WIDTH-30),30+20*i)
+
+      # determine if more notifications exist on next/prev screen
+      self.more = True if notifications.shape[0]-starti > NUM_NOT else False
+      self.prev = True if starti > NUM_NOT-1 else False
+      # and add appropriate buttons
+      if self.more:
+         ing_list['More notifications'] = ((WIDTH/2),10+20*(NUM_NOT+1)+5)
+      elif self.prev:
+         ing_list['Previous'] = ((WIDTH/2),10+20*(NUM_NOT+1)+5)
+
+   def handle_event(self, event):
+      if super(NotificationsScreen,self).handle_event(event):
+         return
+      if(event.type == MOUSEBUTTONUP):
+         x,y=event.pos
+         #check if circle clicked
+         if x > WIDTH-50:
+            for id,pos in self.circle_list.items():
+               if pos[1]-15 < y < pos[1]+15:
+                  #print "deleting ", id
+                  # delete item from fridge
+                  data.submit(None,update_fridge,id,0)
+                  # refresh notifications list
+                  self.request(get_notifications)
+                  return
+         #more notifications
+         if 185<y<205:
+            if self.more:
+               # display notifications starti + NUM_NOT thru starti + 2*NUM_NOT-1
+               self.router.replace(NotificationsScreen(self.starti+self.NUM_NOT,self.notifications))
+            elif self.prev:
+               # display notifications starti-NUM_NOT thru starti-1
+               self.router.replace(NotificationsScreen(self.starti-self.NUM_NOT,self.notifications))
+         #Display Items
+         elif y>210:
+            #back to menu
+            if x<75:
+               self.router.home()
+            #Suggest Recipes
+            elif 100<x<225:
+               self.router.switch(RecipesScreen())
+            #Display Fridge
+            elif x>230:
+               self.router.switch(FridgeScreen(0))
+
+   def render(self, canvas):
+      my_font2 = self.my_font2
+
       # display text items
-      for my_text,text_pos in my_buttons.items():
-         text_surface = my_font2.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         screen.blit(text_surface,text_rect)
-
-      for my_text,text_pos in not_list.items():
-         text_surface = my_font2.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         text_rect.left = 150
-         screen.blit(text_surface,text_rect)
-
-      for my_text,text_pos in ing_list.items():
-         text_surface = my_font2.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         text_rect.left = 50
-         screen.blit(text_surface,text_rect)
-
-      for my_text,text_pos in text_list.items():
-         text_surface = my_font2.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         text_rect.left = 50
-         screen.blit(text_surface,text_rect)
+      for my_text,text_pos in self.my_buttons.items():
+         canvas.image(assets.label(20, my_text, WHITE), center=text_pos)
+
+      for my_text,text_pos in self.text_list.items():
+         canvas.text(my_font2, my_text, WHITE, centery=text_pos[1], left=50)
+
+      if self.notifications is None:
+         self.render_loading(canvas)
+         return
+
+      for my_text,text_pos in self.not_list.items():
+         canvas.text(my_font2, my_text, WHITE, centery=text_pos[1], left=150)
+
+      for my_text,text_pos in self.ing_list.items():
+         canvas.text(my_font2, my_text, WHITE, centery=text_pos[1], left=50)
       # draw circles
-      for index,pos in circle_list.items():
-         pygame.draw.circle(screen, RED, pos,10)
+      for index,pos in self.circle_list.items():
+         canvas.circle(RED, pos,10)
 
-      pygame.display.flip()
-   
-def display_single_recipe(id):
+class RecipeScreen(DataScreen):
    """
    Animates and displays the single recipe screen. The recipe to display is specified
    by its id. The id is extracted from the Postgres backend.
    User may "cook" the recipe, which subtracts the amounts used from the Fridge.
-   Links to display_recipes(), display_instruction()
-   """
-
-   # connect to Postgres
-   conn = psycopg2.connect('dbname=grocery_guard')
-   cur = conn.cursor()
-
-   # fetch name of recipe, ingredients used, amounts used, instructions, and image
-   cur.execute("select name,ingredients,amounts,instructions,image from recipes where id = %s" %str(id))
-   data = cur.fetchone()
-
-   # parse data
-   name = data[0]
-   ingredients = data[1]
-   quantities = data[2]
-   instructions = data[3].split("\n") #instructions separated by line carriage in db
-   #combine quantites and ingredients into amounts. This is what is displayed
-   amounts=['']*len(ingredients)
-   for i in range(len(ingredients)):
-      print str(int(ingredients[i]))
-      cur.execute("select name from codes where id = %s" % str(int(ingredients[i])))
-      amounts[i] = str(quantities[i]) + ' ' + cur.fetchone()[0]
-   
-   recipe = np.asarray([[name.title()],instructions,amounts])
-
-   my_font = pygame.font.Font(None,26)
-   my_font2 = pygame.font.Font(None,20)
-
-   text_list={recipe[0][0]:((WIDTH/2),10)}
-   text_list["-"*WINDOW]=((WIDTH/2),20)
-   text_list["Ingredients:"]=((WIDTH/2),30)
-   text_list2={}
-   # separate ingredients+amounts into two columns
-   for i in range(len(amounts)):
-      if i < 6:
-         text_list[amounts[i]+" "*(i+1)] = ((WIDTH/2),50+20*i)
-      else:
-         text_list2[amounts[i]+" "*(i+1)] = ((WIDTH/2),50+20*(i-6))
-
-   # static buttons
-   my_buttons = {'Show Instructions':(75,220),
-               'Back to Recipes':(250,220)}
-
-   pos = (0,0) 
-
-   #close connection
-   cur.close()
-   conn.close()
-   cooked = False
-
-   # animate and get events
-   while True:
-      #mouse/touchscreen input
-      for event in pygame.event.get():
-         if(event.type is MOUSEBUTTONDOWN):
-            pos=pygame.mouse.get_pos()
-         elif(event.type is MOUSEBUTTONUP):
-            pos=pygame.mouse.get_pos()
-            x,y=pos
-            #cook recipe
-            if y > 170 and 130<x<190 and not cooked:
-               #note: cooked variable allows recipe to be cooked only a single time
-               cooked = True
-               # subtract amounts used from fridge
-               for i in range(len(ingredients)):
-                  #print ingredients[i], quantities[i]
-                  update_fridge(ingredients[i],quantities[i])
-            # static buttons
-            if y>210:
-               #back to menu   
-               if x<140:
-                  display_instruction(instructions,0,id,False)
-               #suggest recipes
-               elif x>190:
-                  recipes = get_recipes()
-                  display_recipes(recipes)
-
-      screen.fill(BLACK) # Erase the Work space
+   Links to RecipesScreen, InstructionScreen
+   """
+
+   def __init__(self, id):
+      self.id = id
+      self.detail = None
+
+      self.my_font2 = assets.font(20)
+
+      self.text_list={}
+      self.text_list2={}
+
+      # static buttons
+      self.my_buttons = {'Show Instructions':(75,220),
+                  'Back to Recipes':(250,220)}
+
+      self.cooked = False
+
+   def enter(self):
+      # fetch name of recipe, ingredients used, amounts used, and instructions
+      # (cached, or loaded with a single query)
+      if self.detail is None:
+         self.request(recipe_cache.get,int(float(self.id)))
+
+   def loaded(self, detail):
+      self.detail = detail
+      #combined quantites and ingredient names. This is what is displayed
+      amounts = detail.amounts
+
+      self.text_list={detail.name.title():((WIDTH/2),10)}
+      self.text_list["-"*WINDOW]=((WIDTH/2),20)
+      self.text_list["Ingredients:"]=((WIDTH/2),30)
+      self.text_list2={}
+      # separate ingredients+amounts into two columns
+      for i in range(len(amounts)):
+         if i < 6:
+            self.text_list[amounts[i]+" "*(i+1)] = ((WIDTH/2),50+20*i)
+         else:
+            self.text_list2[amounts[i]+" "*(i+1)] = ((WIDTH/2),50+20*(i-6))
+
+   def handle_event(self, event):
+      if super(RecipeScreen,self).handle_event(event):
+         return
+      if(event.type == MOUSEBUTTONUP):
+         x,y=event.pos
+         #suggest recipes
+         if y>210 and x>190:
+            self.router.switch(RecipesScreen())
+         if self.detail is None:
+            return
+         #cook recipe
+         if y > 170 and 130<x<190 and not self.cooked:
+            #note: cooked variable allows recipe to be cooked only a single time
+            self.cooked = True
+            # subtract amounts used from fridge in one transaction
+            data.submit(None,consume,list(zip(self.detail.ingredients,self.detail.quantities)))
+         #show instructions
+         if y>210 and x<140:
+            self.router.push(InstructionScreen(self.detail.instructions,0,self.id,False))
+
+   def render(self, canvas):
+      my_font2 = self.my_font2
+
       # display text
-      for my_text,text_pos in my_buttons.items():
-         text_surface = my_font2.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         screen.blit(text_surface,text_rect)
-      
-      for my_text,text_pos in text_list.items():
-         text_surface = my_font2.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         text_rect.left = 50
-         screen.blit(text_surface,text_rect)
-      for my_text,text_pos in text_list2.items():
-         text_surface = my_font2.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         text_rect.left = 175
-         screen.blit(text_surface,text_rect)
+      for my_text,text_pos in self.my_buttons.items():
+         canvas.image(assets.label(20, my_text, WHITE), center=text_pos)
+
+      if self.detail is None:
+         self.render_loading(canvas)
+         return
+
+      for my_text,text_pos in self.text_list.items():
+         canvas.text(my_font2, my_text, WHITE, centery=text_pos[1], left=50)
+      for my_text,text_pos in self.text_list2.items():
+         canvas.text(my_font2, my_text, WHITE, centery=text_pos[1], left=175)
 
       # determine button properties depending on if cooked or not
-      if not cooked:
+      if not self.cooked:
          text = "COOK!"
          button_color = RED
       else:
@@ -634,13 +762,10 @@ def display_single_recipe(id):
          button_color = GREEN
 
       # draw cook/cooked button
-      pygame.draw.circle(screen, button_color, [WIDTH/2,HEIGHT-40],30)
-      text_surface = my_font2.render(text, True, WHITE)
-      text_rect = text_surface.get_rect(center=(WIDTH/2,HEIGHT-40))
-      screen.blit(text_surface,text_rect)
-      pygame.display.flip()
-   
-def display_instruction(instructions,starti,id,s):
+      canvas.circle(button_color, [WIDTH/2,HEIGHT-40],30)
+      canvas.image(assets.label(20, text, WHITE), center=(WIDTH/2,HEIGHT-40))
+
+class InstructionScreen(Screen):
    """
    Display a single instruction in a recipe.
    instructions contains the full list of instructions
@@ -648,288 +773,285 @@ def display_instruction(instructions,starti,id,s):
    id is the id of the recipe from which the instruction is taken
    s is a Boolean indicating whether or not speaking is enabled
    """
-   
-   # define speaking bash command
-   cmd_beg = 'espeak -s150 ' 
-   cmd_end = ' | aplay /home/pi/GroceryGuard/Text.wav 2>/dev/null &'
-   cmd_out = '--stdout > /home/pi/GroceryGuard/Text.wav '
-   
-   # replace spaces with _ in instruction text so epseak can interpret
-   instructions1 = instructions[starti].replace(' ','_')
-   my_font = pygame.font.Font(None,30)
-   my_font2 = pygame.font.Font(None,20)
 
-   text_list={"Step " + str(starti+1):((WIDTH/2),10)}
-   text_list["-"*(WINDOW+5)]=((WIDTH/2),20)
+   def __init__(self, instructions, starti, id, s):
+      self.instructions = instructions
+      self.starti = starti
+      self.id = id
+      self.speak = s
+
+      self.my_font2 = assets.font(20)
+
+      self.text_list={"Step " + str(starti+1):((WIDTH/2),10)}
+      self.text_list["-"*(WINDOW+5)]=((WIDTH/2),20)
+
+      #parse step and add to text_list
+      instr = instructions[starti]
+      wndw = WINDOW-25 # truncated text margin window
+
+      #determine the number of blocks used to display the instruction
+      blocks = int(np.ceil(float(len(instr))/(wndw)))
+      for i in range(blocks):
+         text = instr[wndw*i:wndw*(i+1)].strip()
+         self.text_list[text + " "*(i+1)]=((WIDTH/2),30+20*i)
+
+      # determine if more instructions exist on next/prev screen
+      self.more = True if starti+1 < len(instructions)-1 else False
+      self.prev = True if starti != 0 else False
+
+      # static buttons
+      self.my_buttons = {'Back to Recipe':(160,220)}
+      self.speech_button={'Toggle Speech':((WIDTH-50),10)}
+
+      if self.more:
+         self.my_buttons["Next Step"] = (270,220)
+      if self.prev:
+         self.my_buttons["Previous Step"] = (50,220)
+
+   def say(self):
+      """
+      Start speaking this step, and synthesize the next one while it plays.
+      """
+      speaker.say(self.instructions[self.starti])
+      if self.starti+1 < len(self.instructions):
+         speaker.prefetch(self.instructions[self.starti+1])
+
+   def enter(self):
+      # start speaking
+      if self.speak:
+         self.say()
+
+   def exit(self):
+      if self.speak:
+         speaker.stop() #stop speaking
+
+   def handle_event(self, event):
+      if(event.type == MOUSEBUTTONUP):
+         x,y=event.pos
+
+         if y>210:
+            #previous step
+            if x<100 and self.prev:
+               self.router.replace(InstructionScreen(self.instructions,self.starti-1,self.id,self.speak))
+            # back to recipe screen
+            elif 100<x<225:
+               self.router.pop()
+            # next step
+            elif x>230 and self.more:
+               self.router.replace(InstructionScreen(self.instructions,self.starti+1,self.id,self.speak))
+         #toggle speech
+         elif y<20 and x>220:
+            # enable
+            if self.speak == False:
+               self.speak = True
+               self.say()
+            # disable
+            else:
+               speaker.stop() # stop speaking
+               self.speak = False
+
+   def render(self, canvas):
+      my_font2 = self.my_font2
+      button_color = GREEN if self.speak else RED
 
-   #parse step and add to text_list
-   instr = instructions[starti]
-   wndw = WINDOW-25 # truncated text margin window
-   
-   #determine the number of blocks used to display the instruction
-   blocks = int(np.ceil(float(len(instr))/(wndw)))
-   for i in range(blocks):
-      text = instr[wndw*i:wndw*(i+1)].strip()
-      text_list[text + " "*(i+1)]=((WIDTH/2),30+20*i)
-
-   # determine if more instructions exist on next/prev screen
-   more = True if starti+1 < len(instructions)-1 else False
-   prev = True if starti != 0 else False
-   
-   # static buttons
-   my_buttons = {'Back to Recipe':(160,220)}
-   speech_button={'Toggle Speech':((WIDTH-50),10)}
+      # display text items
+      for my_text,text_pos in self.my_buttons.items():
+         canvas.image(assets.label(20, my_text, WHITE), center=text_pos)
 
-   if more:
-      my_buttons["Next Step"] = (270,220)
-   if prev:
-      my_buttons["Previous Step"] = (50,220)
+      for my_text,text_pos in self.speech_button.items():
+         canvas.image(assets.label(20, my_text, button_color), center=text_pos)
 
-   
-   pos = (0,0) 
-   first=True # first time through loop. Should call speak only on this iteration
-   speak = s
-   
-   # animate screen and get inputs
-   while True:
-      button_color = GREEN if speak else RED
-      #mouse/touchscreen input
-      for event in pygame.event.get():
-         if(event.type is MOUSEBUTTONDOWN):
-            pos=pygame.mouse.get_pos()
-         elif(event.type is MOUSEBUTTONUP):
-            pos=pygame.mouse.get_pos()
-            x,y=pos
-            
-            if y>210:
-               #previous step  
-               if x<100 and prev:
-                  call("kill -9 $(pgrep aplay)",shell=True) #stop speaking
-                  display_instruction(instructions,starti-1,id,speak)
-               # back to recipe screen
-               elif 100<x<225:
-                  call("kill -9 $(pgrep aplay)",shell=True) #stop speaking
-                  display_single_recipe(id)
-               # next step
-               elif x>230 and more:
-                  call("kill -9 $(pgrep aplay)",shell=True) # stop speaking
-                  display_instruction(instructions,starti+1,id,speak)
-            #toggle speech
-            if y<20 and x>220:
-               # enable
-               if speak == False:
-                  speak = True
-                  first = True
-               # disable
-               else:
-                  call("kill -9 $(pgrep aplay)",shell=True) # stop speaking
-                  speak = False
-                  first = False
-
-      screen.fill(BLACK) # Erase the Work space
+      for my_text,text_pos in self.text_list.items():
+         canvas.text(my_font2, my_text, WHITE, centery=text_pos[1], left=25)
 
-      # display text items
-      for my_text,text_pos in my_buttons.items():
-         text_surface = my_font2.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         screen.blit(text_surface,text_rect)
-
-      for my_text,text_pos in speech_button.items():
-         text_surface = my_font2.render(my_text, True, button_color)
-         text_rect = text_surface.get_rect(center=text_pos)
-         screen.blit(text_surface,text_rect)
-
-      for my_text,text_pos in text_list.items():
-         text_surface = my_font2.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         text_rect.left = 25
-         screen.blit(text_surface,text_rect)
-
-      pygame.display.flip()
-      # start speaking
-      if first and speak:
-         call([cmd_beg+cmd_out+'"'+str(instructions1)+'"'+cmd_end], shell=True)
-         first=False
-   
-def display_item_added(item,id):
+class ItemAddedScreen(DataScreen):
    """
    Animates and displays the item added screen.
-   item is the name of the ingredient, and id is its id.
-   Called from home_screen() after the id of the scanned barcode has been obtained.
-   User specifies if correct and should be added to the Fridge
+   id is the id of the scanned ingredient, whose name is looked up when the
+   screen is entered.
+   Opened from HomeScreen after the id of the scanned barcode has been obtained.
+   User specifies if correct and should be added to the Fridge. Barcodes that
+   aren't in the codes table are shown as unknown and can't be added.
    """
-   
-   my_font = pygame.font.Font(None,30)
-   my_font2 = pygame.font.Font(None,20)
-   
-   # header
-   text_list={"Item Added!":((WIDTH/2),10)}
-   text_list["-"*WINDOW]=((WIDTH/2),20)
 
-   # body
-   text_list2={item.title() + " added":((WIDTH/2),100)}
-   
-   #static buttons
-   my_buttons = {'Incorrect?':(75,220),
-               'Correct?':(250,220)}
+   def __init__(self, id):
+      self.id = id
+      self.item = None
+      self.found = None # whether id is in codes, None until looked up
 
-   pos = (0,0) 
-   
-   # animate and get events
-   while:
-      #mouse/touchscreen input
-      for event in pygame.event.get():
-         if(event.type is MOUSEBUTTONDOWN):
-            pos=pygame.mouse.get_pos()
-         elif(event.type is MOUSEBUTTONUP):
-            pos=pygame.mouse.get_pos()
-            x,y=pos
-            #Display Items
-            if y>210:
-               # back to menu   
-               if x<140:
-                  home_screen()
-               # add the fridge and return to menu
-               elif x>190:
-                  add_to_fridge(id)
-                  home_screen()
-
-      screen.fill(BLACK) # Erase the Work space
+      self.my_font = assets.font(30)
+      self.my_font2 = assets.font(20)
+
+      # header
+      self.text_list={"Item Added!":((WIDTH/2),10)}
+      self.text_list["-"*WINDOW]=((WIDTH/2),20)
+
+      # body
+      self.text_list2={}
+
+      #static buttons
+      self.my_buttons = {'Incorrect?':(75,220),
+                  'Correct?':(250,220)}
+
+   def enter(self):
+      if self.found is None:
+         self.request(get_item_name,self.id)
+
+   def loaded(self, item):
+      self.item = item
+      self.found = item is not None
+      if self.found:
+         self.text_list2={item.title() + " added":((WIDTH/2),100)}
+      else:
+         self.text_list={"Unknown Item":((WIDTH/2),10)}
+         self.text_list["-"*WINDOW]=((WIDTH/2),20)
+         self.text_list2={str(self.id) + " not found":((WIDTH/2),100)}
+         self.my_buttons = {'Menu':(75,220)}
+
+   def handle_event(self, event):
+      if super(ItemAddedScreen,self).handle_event(event):
+         return
+      if(event.type == MOUSEBUTTONUP):
+         x,y=event.pos
+         if y>210:
+            # back to menu
+            if x<140:
+               self.router.home()
+            # add the fridge (or queue it while unpacking) and return to menu
+            elif x>190 and self.found:
+               if unpacking is not None:
+                  unpacking.add(self.id)
+               else:
+                  data.submit(None,add_to_fridge,self.id)
+               self.router.home()
+
+   def render(self, canvas):
       # display text items
-      for my_text,text_pos in my_buttons.items():
-         text_surface = my_font2.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         screen.blit(text_surface,text_rect)
+      for my_text,text_pos in self.my_buttons.items():
+         canvas.image(assets.label(20, my_text, WHITE), center=text_pos)
 
-      for my_text,text_pos in text_list.items():
-         text_surface = my_font2.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         text_rect.left = 50
-         screen.blit(text_surface,text_rect)
+      for my_text,text_pos in self.text_list.items():
+         canvas.text(self.my_font2, my_text, WHITE, centery=text_pos[1], left=50)
 
-      for my_text,text_pos in text_list2.items():
-         text_surface = my_font.render(my_text, True, WHITE)
-         text_rect = text_surface.get_rect(center=text_pos)
-         screen.blit(text_surface,text_rect)
+      if self.found is None:
+         self.render_loading(canvas)
+         return
 
-      pygame.display.flip()
+      for my_text,text_pos in self.text_list2.items():
+         canvas.text(self.my_font, my_text, WHITE, center=text_pos)
 
 # ---------------- Functional methods ---------------- #
 
-def scan():
+def get_scanner():
    """
-   return UPC number if barcode detected. Return -1 if no barcode detected.
-   called from home_screen at regular intervals
+   Return the barcode scanner process, starting it (and opening the camera) the
+   first time it is needed. Decoded barcodes are posted as SCAN_EVENTs.
    """
-   #initialize camera
-   pygame.init()
-   pygame.camera.init()
-   pygame.camera.list_cameras()
-   cam = pygame.camera.Camera(CAM_NAME, CAM_RES,'RGB')
-   
-   # sometimes, USB camera is detected at /dev/video0, other times at /dev/video1
-   try:
-      cam.start()
-   except:
-      cam = pygame.camera.Camera('/dev/video1', CAM_RES,'RGB')
-      cam.start()
-
-   time.sleep(0.5) 
-   pygame_screen_image = cam.get_image() #get the image
-   cam.stop()
-
-   img_arr = pygame.surfarray.array3d(pygame_screen_image)
-   
-   #convert to grayscale and cast to uint8 so zbar can interpret
-   img_arr = np.dot(img_arr[...,:3], [0.299, 0.587, 0.114])
-   img_arr=img_arr.astype(np.uint8)
-   
-   #now that we have the image, scan for a barcode
-   scanner = zbar.Scanner()
-   results = scanner.scan(img_arr)
-   if results==[]:
-      print "no barcode found"
-      return -1
-   else:
-      for result in results:
-         # By default zbar returns barcode data as byte array, so decode byte array$
-         #print(result.type, result.data.decode("ascii"), result.quality)
-         return int(result.data.decode("ascii")) #return just the code as an int
-   
+   global scanner
+   if scanner is None:
+      source = functools.partial(PygameFrameSource,[CAM_NAME,CAM_FALLBACK],CAM_RES)
+      process = ScannerProcess(source,CAM_RES,SCAN_THRESHOLD,SCAN_FAST,SCAN_SLOW,SCAN_REPEAT,
+                               stats=metrics)
+      process.start(post_scan_event)
+      scanner = process
+   return scanner
+
+def post_scan_event(upc, quality):
+   """
+   Post SCAN_EVENT to the pygame event queue (called from the scanner relay thread).
+   """
+   pygame.event.post(pygame.event.Event(SCAN_EVENT,upc=upc,quality=quality))
+
+def start_unpacking():
+   """
+   Open an unpacking session whose flushes are written by add_items on the data
+   executor, in order with the other writes. Scans whose write fails go back in
+   the session's queue for its next flush.
+   """
+   def write(ids):
+      try:
+         add_items(ids)
+      except Exception:
+         traceback.print_exc()
+         if not session.requeue(ids):
+            print(str(len(ids)) + " scans could not be written")
+   session = UnpackSession(lambda ids: data.submit(None,write,ids),UNPACK_ITEMS,UNPACK_AGE)
+   return session
+
+def poll_unpacking(event):
+   """
+   Write the open unpacking session's scans once they have waited UNPACK_AGE
+   seconds. Registered with the router for UNPACK_EVENT.
+   """
+   if unpacking is not None:
+      unpacking.poll()
+
 def get_item_name(id):
    """
-   Gets the name of an item id from Postgres
+   Gets the name of an item id from the codes cache (Postgres on a miss), or None
+   if the id isn't in codes
    """
-   id = str(int(id)) # eliminate trailing decimals and cast to string
-   # connect to db
-   conn = psycopg2.connect('dbname=grocery_guard')
-   cur = conn.cursor()
-   # select name and quantity from barcodes table
-   cur.execute("select name,quantity from codes where id = %s" % id)
-   data = np.asarray(cur.fetchone())
-   name = data[0]
-   
-   #close connection
-   cur.close()
-   conn.close()
-   return name.title()
+   item = catalog.by_id(id)
+   if item is None:
+      return None
+   return item[0].title()
 
 def get_item_id(name):
    """
-   Gets the id of an item name from Postgres
+   Gets the id of an item name from the codes cache (Postgres on a miss)
    """
-   # connect to db
-   conn = psycopg2.connect('dbname=grocery_guard')
-   cur = conn.cursor()
-   # select id from barcodes db
-   cur.execute("select id from codes where name ='%s'" % name.lower())
-   data = np.asarray(cur.fetchone())
-   id = data[0]
-   
-   # close connection
-   cur.close()
-   conn.close()
-   return id
+   return catalog.by_name(name)
 
 def add_to_fridge(id):
    """
    Add an item id to the Fridge. Gets name, amount, exp length from codes table 
-   and writes to fridge. Called from home_screen after a valid barcode is detected
+   and writes to fridge. Called from ItemAddedScreen after a valid barcode is detected
    and confirmed by the user.
    """
-   id = str(int(id))
-   # connect to db
-   conn = psycopg2.connect('dbname=grocery_guard')
-   cur = conn.cursor()
-   # get name, amount, expiration length from codes
-   cur.execute("select name,quantity,exp_days from codes where id = %s" % id)
-   data = np.asarray(cur.fetchone())
-   name = data[0]
-   # convert strings to ints
-   quantity = int(float(data[1]))   #amounts
-   exp_days = int(float(data[2]))   #expiration length
-   added = "date '" + str(datetime.date.today()) + "'" #date added
-   
-   #check if already in fridge
-   cur.execute("select exists(select 1 from fridge where id = %s)" % id)
-   exists = cur.fetchone()[0]
-   # add amount to existing row
-   if exists:
-      cur.execute("select quantity from fridge where id = %s" % id)
-      amt = int(cur.fetchone()[0]+quantity)
-      msg = "update fridge set quantity = %s where id = %s" %(amt,id)
-   # insert new row
-   else:
-      # write to fridge id, name, quantity, added, exp_days
-      msg = "insert into fridge values (%s, '%s', %s, %s, %s)" % (id,name,quantity,added,exp_days)
-   cur.execute(msg)
+   add_items([id])
 
-   # commit the write
-   conn.commit()
+def add_items(ids):
+   """
+   Add several scanned item ids to the Fridge with a single upsert. An id listed
+   n times adds n times its amount. New items are inserted; items already in the
+   Fridge (fridge.id is its primary key) have the amount added to their quantity.
+   Ids that aren't in codes are skipped.
+   """
+   # total scans per item, in first scanned order
+   counts = {}
+   order = []
+   for id in ids:
+      id = int(id)
+      if id not in counts:
+         counts[id] = 0
+         order.append(id)
+      counts[id] += 1
+   args = []
+   names = {}
+   for id in order:
+      # get name, amount, expiration length from codes
+      data = catalog.by_id(id)
+      if data is None:
+         continue
+      names[id] = data[0]
+      # convert strings to ints
+      quantity = int(float(data[1]))*counts[id]   #amounts
+      exp_days = int(float(data[2]))   #expiration length
+      # write to fridge id, name, quantity, added, exp_days
+      args += [id,data[0],quantity,exp_days]
+   if not names:
+      return
+   values = ",".join(["(%s,%s,%s,current_date,%s)"]*len(names))
+
+   # write is committed when the cursor block exits
+   with db.cursor() as cur:
+      cur.execute("insert into fridge values " + values + " on conflict (id) do update "
+                  "set quantity = fridge.quantity + excluded.quantity "
+                  "returning id,quantity,added+exp_days", args)
+      f = cur.fetchall()
 
-   # close connection
-   cur.close()
-   conn.close()
+   for ing in f:
+      fridge_changed(ing[0],int(ing[1]),names[int(ing[0])],ing[2])
 
 def update_fridge(id,amt):
    """
@@ -937,70 +1059,77 @@ def update_fridge(id,amt):
    id stored in the Fridge.
    If amt<=0, then delete the ingredient from the fridge.
    """
-   
-   id = str(int(id))
-   # connect to the db
-   conn = psycopg2.connect('dbname=grocery_guard')
-   cur = conn.cursor()
-   
-   #check if ingredient in fridge
-   cur.execute("select exists(select 1 from fridge where id = %s)" % id)
-   exists = cur.fetchone()[0]
-   if exists:
-      # get amount currently in fridge
-      cur.execute("select quantity from fridge where id = %s" % id)
-      quantity = int(np.asarray(cur.fetchone())[0])
-      # calculate the new amount
-      if amt > 0:
-         new_amt = int(quantity-amt)
-      else:
-         # if this update brings quantity negative, flag
-         new_amt = -1
+   consume([(id,amt)])
 
-      #remove from fridge
-      if new_amt <= 0:
-         cur.execute("delete from fridge where id = %s" % id)
-      #update fridge with new value
+def consume(items):
+   """
+   Subtract several item quantities from the Fridge at once, e.g. when a recipe is
+   cooked. items is a list of (id, amt) pairs with the same meaning as the
+   arguments of update_fridge(); an ingredient listed twice is subtracted twice.
+   All decrements and deletions are applied in one transaction and a single round
+   trip. Each UPDATE locks its rows, so concurrent changes can't interleave.
+   As in the original update_fridge, the remaining quantity is truncated to a
+   whole number and the item is deleted once it drops to 0 or below.
+   """
+   # total amount used per ingredient, None if it should be deleted
+   used = {}
+   for id,amt in items:
+      id = int(id)
+      if amt > 0 and used.get(id,0) is not None:
+         used[id] = used.get(id,0) + amt
       else:
-         cur.execute("update fridge set quantity = %s where id = %s" % (str(new_amt),id))
-
-      #commit write
-      conn.commit()
-
-   # close connection
-   cur.close()
-   conn.close()
+         used[id] = None
+   if not used:
+      return
+
+   ids = list(used)
+   values = ",".join(["(%s,%s::numeric)"]*len(ids))
+   args = []
+   for id in ids:
+      args += [id,used[id]]
+
+   # write is committed when the cursor block exits
+   with db.cursor() as cur:
+      # subtract and truncate (deleted items drop to 0), remove empty items,
+      # read back what's left
+      cur.execute("update fridge f set quantity = trunc(f.quantity - coalesce(u.amt,f.quantity)) "
+                  "from (values " + values + ") as u(id,amt) where f.id = u.id; "
+                  "delete from fridge where id = any(%s) and quantity <= 0; "
+                  "select id,quantity from fridge where id = any(%s)",
+                  args + [ids,ids])
+      left = dict((int(ing[0]),int(ing[1])) for ing in cur.fetchall())
+
+   for id in ids:
+      fridge_changed(id,left.get(id))
+
+def fridge_changed(id,quantity,name=None,expires=None):
+   """
+   Tell the cached recipe scores and notifications that the Fridge now holds quantity
+   of item id. quantity is None if the item was removed. name and expires (date the
+   item expires) are used if the item is new to the notifications cache.
+   Only recipes using the item are rescored.
+   """
+   if recipe_index is not None:
+      recipe_index.set_quantity(int(id),quantity)
+   if expiry is not None:
+      expiry.update(int(id),quantity,name,expires)
 
 def get_ingredients():
    """
    Get list of ingredients and amounts currently contained in the Fridge.
-   Queries Postgres 'fridge' table and formats ingredients as a numpy array.
-   Format of each entry is np.asarray([ing1,ing2,...])
-   where ingi = "Name amt+unit time to expire in days"
+   Queries Postgres 'fridge' table and returns a numpy structured array with one
+   FRIDGE_DTYPE record per ingredient:
+      id       UPC of the ingredient
+      name     name of the ingredient
+      quantity amount in the fridge
+      days     days until the ingredient expires (negative once expired)
    """
-   
-   # connect to db
-   conn = psycopg2.connect('dbname=grocery_guard')
-   cur = conn.cursor()
-   # get name + amt + exp length + date added
-   cur.execute("select name,quantity,added,exp_days from fridge")
-   f = np.asarray(cur.fetchall())
-   ingredients = np.asarray([])
-   # parse query and format
-   for ing in f:
-      name = ing[0]
-      quantity = ing[1]
-      added = ing[2]
-      exp_on = added + datetime.timedelta(ing[3])
-      days_to_exp = exp_on - datetime.date.today()
-
-      msg = ' '.join([name,str(int(quantity)),str(days_to_exp)])
-      ingredients = np.append(ingredients,msg)
-   
-   # close connection
-   cur.close()
-   conn.close()
-   return ingredients
+   with db.cursor() as cur:
+      # get id + name + amt + days to expiry (date added + exp length - today)
+      cur.execute("select id,name,quantity,added+exp_days-current_date from fridge")
+      f = cur.fetchall()
+   return np.array([(int(ing[0]),ing[1],int(ing[2]),int(ing[3])) for ing in f],
+                   dtype=FRIDGE_DTYPE)
    
 def get_recipes():
    """
@@ -1008,117 +1137,194 @@ def get_recipes():
    Formats each recipe as np.asarray([[recipe1,recipe2,...],[id1,id2,...]])
    where recipei = 'name %match'
    %match = #ing in fridge used by recipe/# total ing used by recipe
+   If fewer than 5 recipes match, the remaining entries have a blank name and id 0.
+   If RECIPE_STREAMING is set, the recipes table is scored in batches through a
+   server-side cursor instead of being held in memory.
    """
+   if RECIPE_STREAMING:
+      with db.cursor() as cur:
+         cur.execute("select id,quantity from fridge")
+         f = cur.fetchall()
+      with db.cursor('recipe_stream') as cur:
+         max_recipes,rec_names,overlap = stream_top(cur,[ing[0] for ing in f],
+                                                    [ing[1] for ing in f],NUM_REC,RECIPE_BATCH)
+   else:
+      # cached scores are kept up to date by add_to_fridge and update_fridge
+      index = get_recipe_index()
+      rows,overlap = index.top()
+      max_recipes = [index.matrix.ids[r] for r in rows]
+      rec_names = [index.matrix.names[r] for r in rows]
 
-   # initialize max overlap recipe tracking arrays
-   max_recipes = np.asarray([0,0,0,0,0])  #IDs of max overlap recipes
-   max_overlap = np.asarray([0,0,0,0,0])
-
-   # connect tp db
-   conn = psycopg2.connect('dbname=grocery_guard')
-   cur = conn.cursor()
-   # get all item ids from fridge (as UPC numbers)
-   cur.execute("select id from fridge")
-   I = np.asarray(cur.fetchall())
-   # get all recipe ids from fride
-   cur.execute("select id from recipes")
-   recipes = np.asarray(cur.fetchall())
-   
-   #get max recipe ID to use as loop control
-   cur.execute("select id from recipes where id = (select max(id) from recipes)")
-   num_recs = int(cur.fetchone()[0])
-   
-   # Determine amount of overlap with Fridge for each recipe in db
-   for r in range(1,num_recs+1):
-      # get ingredients+amounts from recipe r
-      cur.execute("select ingredients from recipes where id = %s" % str(r))
-      ri = np.asarray(cur.fetchone())[0]  #ingredients for recipe r
-      cur.execute("select amounts from recipes where id = %s" % str(r))
-      ra = np.asarray(cur.fetchone())[0]  #amounts for recipe r
-      
-      # calculate the size of the overlap based on id
-      s = np.intersect1d(ri,I)
-      n = s.size
-
-      # if we don't contain enough of an ingredient, subtract from the size of the overlap
-      for i in s:
-         # get index of i in recipe r's ingredient list
-         # ra[indr] = amount of ingredient i recipe r requires
-         indr = np.where(ri==i)[0][0] # index of i in r's ingredient list
-         
-         # get amount of ingredient id from fridge
-         cur.execute("select quantity from fridge where id = %s" % str(int(i)))
-         tmp = cur.fetchone()[0]
-         
-         # if amount we have < amount we need, deincrement n
-         if tmp < ra[indr] :
-            n-=1
-      
-      # current minially overlapping recipe as a percentage
-      m = np.min(max_overlap)
-
-      n = float(n)/ra.shape[0] #convert to percentage
-
-      # if recipe r overlaps more than minimum overlapping recipe, add r to sugggestion list
-      if n > m:
-         ind = np.where(max_overlap==m)[0][0]
-         max_overlap = np.delete(max_overlap,ind)
-         max_overlap = np.append(max_overlap,n)
-         max_recipes = np.delete(max_recipes,ind)
-         max_recipes = np.append(max_recipes,r)
-
-   #get recipe names
-   names = np.asarray([])
-   for i in range(max_recipes.size):
-      cur.execute("select name from recipes where id = %s" % str(max_recipes[i]))
-      try:
-         result = cur.fetchone()[0]
-      # case where fewer than 5 recipes are suggested
-      except:
-         result = ' '
-      names = np.append(names,result + ' ' + str(max_overlap[i]))
+   # format, padding the list up to NUM_REC entries
+   names = [n + ' ' + str(o) for n,o in zip(rec_names,overlap)]
+   names += ['  0.0']*(NUM_REC-len(names))
+   max_recipes += [0]*(NUM_REC-len(max_recipes))
 
    return np.asarray([names,max_recipes])
 
-def get_notifications(ingredients):
+def get_recipe_index():
+   """
+   Return the RecipeIndex of recipe scores, loading the recipes table and the
+   Fridge from Postgres the first time it is needed.
+   Call reload_recipes() after the recipes table changes.
+   """
+   global recipe_index
+   if recipe_index is None:
+      with db.cursor() as cur:
+         index = RecipeIndex(RecipeMatrix.load(cur),NUM_REC)
+         cur.execute("select id,quantity from fridge")
+         f = cur.fetchall()
+      index.load_fridge([ing[0] for ing in f],[ing[1] for ing in f])
+      recipe_index = index
+   return recipe_index
+
+def reload_recipes():
+   """
+   Drop the cached recipe scores so the next get_recipes() reloads the recipes table.
+   """
+   global recipe_index
+   recipe_index = None
+
+def get_notifications(ingredients=None):
    """
    Compute notifications based on ingredients list.
-   ingredients must be formatted as a numpy array:
-      ingredients = np.asarray([ing1,ing2,ing3,...])
-      where ingi = "Name amt+unit time to expire in days"
+   ingredients is a numpy structured array of FRIDGE_DTYPE records, as returned by
+   get_ingredients(). If None, the notifications cached by the expiry scheduler are
+   returned if it is running; otherwise only the ingredients that need a
+   notification are fetched, with a single query backed by the FRIDGE_INDEXES.
    Notifications include:
-      item running low
-      item about to expire
+      item running low (quantity <= ING_LOW)
+      item about to expire (expires within EXP_DAYS)
       item expired
+   Returns a numpy structured array of NOTIFY_DTYPE records, in ingredient order
+   with the low notification before the expiry one.
    """
-   EXP_DAYS = 5 #number of days til expiration to trigger notification
-   ING_LOW = 5 #number of ingredient units to trigger notification
-   notifications = np.asarray([])
-
-   # determine notifications for each ingredient
-   for ing in ingredients:
-      #parse ingredient into name, amount, exp days
-      ing_list = ing.split()
-      name = " ".join(ing_list[:-4])
-      amount = ing_list[-4]
-      exp = ing_list[-3]
-      
-      # ingredient low
-      if int(amount) <= ING_LOW:
-         msg = name + ";low"
-         notifications = np.append(notifications, msg)
-      if int(exp) <= EXP_DAYS:
-         # ingredient expired
-         if int(exp) < 0:
-            msg = name + ";expired " + str(-1*int(exp)) + " days ago"
-         # ingredient about to expire
-         else:
-            msg = name + ";expiring in " + exp + " days"
-         notifications = np.append(notifications, msg)
-
+   if ingredients is None and expiry is not None:
+      return np.array(expiry.notifications(),dtype=NOTIFY_DTYPE)
+   if ingredients is None:
+      with db.cursor() as cur:
+         cur.execute("select id,name,quantity,added+exp_days-current_date from fridge "
+                     "where added+exp_days <= current_date+%s or quantity <= %s",
+                     (EXP_DAYS,ING_LOW))
+         f = cur.fetchall()
+      ingredients = np.array([(int(ing[0]),ing[1],int(ing[2]),int(ing[3])) for ing in f],
+                             dtype=FRIDGE_DTYPE)
+
+   # indices of ingredients running low / expiring, merged back into ingredient order
+   low = np.flatnonzero(ingredients['quantity'] <= ING_LOW)
+   exp = np.flatnonzero(ingredients['days'] <= EXP_DAYS)
+   rows = np.concatenate([low,exp])
+   is_exp = np.concatenate([np.zeros(low.size,bool),np.ones(exp.size,bool)])
+   order = np.lexsort((is_exp,rows))
+   rows = rows[order]
+   is_exp = is_exp[order]
+
+   days = ingredients['days'][rows]
+   notifications = np.empty(rows.size,dtype=NOTIFY_DTYPE)
+   notifications['id'] = ingredients['id'][rows]
+   notifications['name'] = ingredients['name'][rows]
+   notifications['expired'] = is_exp & (days < 0)
+   notifications['message'] = [expiry_message(d) if e else "low" for e,d in zip(is_exp,days)]
    return notifications
 
+def start_expiry_scheduler():
+   """
+   Load the Fridge into the expiry scheduler and start it. From then on
+   get_notifications() is served from its cache, and NOTIFY_EVENT is posted
+   whenever an item crosses an expiry threshold or the Fridge changes.
+   """
+   global expiry
+   with db.cursor() as cur:
+      cur.execute("select id,name,quantity,added+exp_days from fridge")
+      f = cur.fetchall()
+   scheduler = ExpiryScheduler(EXP_DAYS,ING_LOW,post_notify_event)
+   scheduler.load([(int(ing[0]),ing[1],int(ing[2]),ing[3]) for ing in f])
+   scheduler.start()
+   expiry = scheduler
+
+def post_notify_event(count):
+   """
+   Post NOTIFY_EVENT to the pygame event queue (called from the scheduler thread).
+   """
+   pygame.event.post(pygame.event.Event(NOTIFY_EVENT,count=count))
+
+def create_indexes():
+   """
+   Create the fridge indexes used by get_notifications() if they don't exist yet.
+   """
+   with db.cursor() as cur:
+      for msg in FRIDGE_INDEXES:
+         cur.execute(msg)
+
+# ---------------- Bootstrap ---------------- #
+
+def init_display(env=DISPLAY_ENV):
+   """
+   Set env (the TFT framebuffer and touchscreen), open the display and create the
+   canvas, event loop and router drawing on it. Only the display and font modules
+   are initialized; nothing else in pygame is used by the UI process.
+   """
+   global screen, canvas, loop, router
+   if screen is not None:
+      return
+   os.environ.update(env)
+   pygame.display.init()
+   pygame.font.init()
+   # Hide mouse on touchscreen
+   pygame.mouse.set_visible(False)
+   screen = pygame.display.set_mode(SIZE)
+   canvas = Canvas(screen,BLACK)
+   loop = EventLoop(FPS)
+   router = Router(loop,canvas,metrics)
+   # the unpacking session ages out on every screen, not just home
+   router.on(UNPACK_EVENT,poll_unpacking)
+
+def init_gpio():
+   """
+   Set up GPIO 27 as "bailout" to desktop.
+   """
+   import RPi.GPIO as GPIO
+   GPIO.setmode(GPIO.BCM)
+   GPIO.setup(27, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+   # Add threaded callback interrupt for GPIO 27
+   GPIO.add_event_detect(27,GPIO.FALLING,callback=GPIO27_callback,bouncetime=300)
+
+def warm_up():
+   """
+   Connect to Postgres and load the caches the screens read from: fridge indexes,
+   codes catalog and expiry scheduler. Runs on the data executor once the home
+   screen is showing, so screens that query before it finishes wait behind it.
+   """
+   with metrics.timer('boot.warm_up'):
+      db.warm()
+      create_indexes()
+      catalog.load()
+      start_expiry_scheduler()
+   # the home screen was drawn without a badge
+   post_notify_event(expiry.count)
+
+def main():
+   """
+   Bootstrap the Grocery Guard. The home screen is drawn as soon as the display is
+   up; the camera, GPIO and database are started after that first frame. The time
+   from here to the first frame is recorded as boot.home.
+   """
+   start = timeit.default_timer()
+   init_display()
+   assets.load(LABELS,{'power':power_icon})
+   if STATS_OVERLAY:
+      router.overlay = draw_stats_overlay
+   # default to home screen
+   router.push(HomeScreen())
+   router.dispatch([])
+   metrics.record('boot.home',(timeit.default_timer()-start)*1000.0)
+   # fork the scanner before any worker threads are running
+   get_scanner()
+   init_gpio()
+   data.submit(None,warm_up)
+   metrics.start_dumping(STATS_FILE,STATS_INTERVAL)
+   router.run()
+
 if __name__ == "__main__":
       """Driver"""
-      # default to home screen
-      home_screen()
+      main()
@@ -0,0 +1,118 @@
+"""
+Shared database access for the Grocery Guard.
+All functional methods go through a Database, which keeps a small pool of open
+connections to the PostgreSQL back end instead of connecting on every call.
+The DSN defaults to the local grocery_guard database and can be overridden with
+the GROCERY_GUARD_DSN environment variable.
+"""
+
+import contextlib
+import os
+import threading
+
+DSN = os.environ.get('GROCERY_GUARD_DSN', 'dbname=grocery_guard')
+
+def psycopg2_connect(dsn):
+   import psycopg2
+   return psycopg2.connect(dsn)
+
+class Database(object):
+   """
+   Small thread-safe connection pool.
+   dsn is the connection string passed to connect.
+   maxconn is the largest number of connections open at once; callers block until
+   a connection is free.
+   connect is a function dsn -> DB-API connection. Defaults to psycopg2.connect;
+   pass another factory to run against a test server or an embedded stand-in.
+   Connections are only opened when first needed.
+   """
+
+   def __init__(self, dsn=DSN, maxconn=4, connect=psycopg2_connect):
+      self.dsn = dsn
+      self.maxconn = maxconn
+      self.connect = connect
+      self._idle = [] # open connections not in use
+      self._lock = threading.Lock()
+      self._slots = threading.BoundedSemaphore(maxconn)
+
+   def _acquire(self):
+      self._slots.acquire()
+      try:
+         with self._lock:
+            while self._idle:
+               conn = self._idle.pop()
+               if not getattr(conn, 'closed', False):
+                  return conn
+         return self.connect(self.dsn)
+      except Exception:
+         self._slots.release()
+         raise
+
+   def _release(self, conn, discard=False):
+      try:
+         if discard:
+            try:
+               conn.close()
+            except Exception:
+               pass
+         else:
+            with self._lock:
+               self._idle.append(conn)
+      finally:
+         self._slots.release()
+
+   @contextlib.contextmanager
+   def connection(self):
+      """
+      Borrow a connection from the pool. The transaction is committed when the
+      block exits normally and rolled back if it raises.
+      """
+      conn = self._acquire()
+      try:
+         yield conn
+         conn.commit()
+      except Exception:
+         discard = False
+         try:
+            conn.rollback()
+         except Exception:
+            # connection is broken, don't hand it out again
+            discard = True
+         self._release(conn, discard)
+         raise
+      self._release(conn)
+
+   @contextlib.contextmanager
+   def cursor(self, name=None):
+      """
+      Borrow a connection and open a cursor on it. See connection().
+      If name is given, a named (server-side) cursor is opened, which fetches rows
+      from the server as they are iterated instead of all at once.
+      """
+      with self.connection() as conn:
+         cur = conn.cursor(name) if name else conn.cursor()
+         try:
+            yield cur
+         finally:
+            cur.close()
+
+   def warm(self, n=1):
+      """
+      Open up to n connections ahead of time so the first query doesn't pay for it.
+      """
+      conns = []
+      try:
+         for i in range(min(n, self.maxconn)):
+            conns.append(self._acquire())
+      finally:
+         for conn in conns:
+            self._release(conn)
+
+   def close(self):
+      """
+      Close all idle connections.
+      """
+      with self._lock:
+         idle, self._idle = self._idle, []
+      for conn in idle:
+         conn.close()
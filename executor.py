@@ -0,0 +1,110 @@
+"""
+Data access executor for the Grocery Guard.
+Screens submit database calls to worker threads instead of running them in the
+event handler, and get each result back as a pygame user event, so the UI keeps
+drawing and taking input while a query runs. Requests are grouped by owner (the
+screen that made them) and can be cancelled when the owner goes away: a
+cancelled request that hasn't started is skipped and one that is running has its
+result dropped.
+"""
+
+import threading
+import traceback
+from multiprocessing.pool import ThreadPool
+
+import pygame
+
+class Request(object):
+   """
+   One submitted call. Once done, result holds the return value, or error the
+   exception it raised.
+   """
+
+   __slots__ = ('owner', 'fn', 'args', 'cancelled', 'done', 'result', 'error')
+
+   def __init__(self, owner, fn, args):
+      self.owner = owner
+      self.fn = fn
+      self.args = args
+      self.cancelled = False
+      self.done = False
+      self.result = None
+      self.error = None
+
+   def get(self):
+      """
+      The result, or raise the call's exception in the caller's thread.
+      """
+      if self.error is not None:
+         raise self.error
+      return self.result
+
+class DataExecutor(object):
+   """
+   event_type is the pygame event posted with .request when a request finishes.
+   workers is the number of worker threads. With the default of one, requests
+   run in the order they were submitted, so a read submitted after a write sees
+   the write. The worker threads are started by the first submit().
+   """
+
+   def __init__(self, event_type, workers=1, post=None):
+      self.event_type = event_type
+      self.post = post or pygame.event.post
+      self.workers = workers
+      self.pool = None
+      self.pending = {} # id(owner) -> list of unfinished requests
+      self._lock = threading.Lock()
+
+   def submit(self, owner, fn, *args):
+      """
+      Run fn(*args) on a worker thread. owner is whatever cancel() is later called
+      with, usually the submitting screen; None for requests that must complete
+      (writes). Returns the Request.
+      """
+      request = Request(owner, fn, args)
+      with self._lock:
+         if self.pool is None:
+            self.pool = ThreadPool(self.workers)
+         if owner is not None:
+            self.pending.setdefault(id(owner), []).append(request)
+      self.pool.apply_async(self._run, (request,))
+      return request
+
+   def cancel(self, owner):
+      """
+      Cancel every unfinished request of owner.
+      """
+      with self._lock:
+         requests = self.pending.pop(id(owner), ())
+      for request in requests:
+         request.cancelled = True
+
+   def _run(self, request):
+      if request.cancelled:
+         return
+      try:
+         request.result = request.fn(*request.args)
+      except Exception as e:
+         traceback.print_exc()
+         request.error = e
+      request.done = True
+      if request.owner is not None:
+         with self._lock:
+            requests = self.pending.get(id(request.owner))
+            if requests is not None and request in requests:
+               requests.remove(request)
+               if not requests:
+                  del self.pending[id(request.owner)]
+      if not request.cancelled:
+         self.post(pygame.event.Event(self.event_type, request=request))
+
+   def close(self):
+      """
+      Finish the submitted requests and stop the worker threads. A later submit()
+      starts new ones.
+      """
+      with self._lock:
+         pool, self.pool = self.pool, None
+      if pool is not None:
+         pool.close()
+         pool.join()
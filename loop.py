@@ -0,0 +1,51 @@
+"""
+Central event loop for the Grocery Guard screens.
+Screens block on pygame.event.wait() instead of spinning, so an idle device sleeps
+until the touchscreen or a timer produces an event. Periodic work (barcode
+scanning, expiry notifications) arrives as pygame user events from
+pygame.time.set_timer or background threads, with wall-clock intervals that don't
+depend on how fast frames are drawn. A frame-rate cap bounds the redraw rate
+while events are streaming in.
+"""
+
+import pygame
+
+class EventLoop(object):
+   """
+   fps is the most frames per second a screen is redrawn at.
+   """
+
+   def __init__(self, fps=30):
+      self.fps = fps
+      self.clock = pygame.time.Clock()
+      self.timers = {} # event type -> interval in seconds
+      self._woken = False
+
+   def set_timer(self, event_type, seconds):
+      """
+      Post event_type every seconds seconds. 0 or None stops the timer.
+      """
+      if seconds:
+         self.timers[event_type] = seconds
+         pygame.time.set_timer(event_type, max(1, int(seconds*1000)))
+      else:
+         self.timers.pop(event_type, None)
+         pygame.time.set_timer(event_type, 0)
+
+   def wake(self):
+      """
+      Make the next events() call return without waiting, so a screen that was just
+      entered draws its first frame straight away.
+      """
+      self._woken = True
+
+   def events(self):
+      """
+      Wait for the next event and return it with any others already queued.
+      Waits first if the previous frame was less than 1/fps seconds ago.
+      """
+      self.clock.tick(self.fps)
+      if self._woken:
+         self._woken = False
+         return pygame.event.get()
+      return [pygame.event.wait()] + pygame.event.get()
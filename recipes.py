@@ -0,0 +1,336 @@
+"""
+Recipe matching engine for the Grocery Guard.
+The recipes table is loaded once into a compact sparse recipe x ingredient matrix
+(CSR-style NumPy arrays) and every recipe is scored against the fridge in a single
+vectorized pass. For catalogs too large to hold in memory, stream_top() scores the
+recipes batch by batch from a server-side cursor instead.
+RecipeCache holds the details of recently viewed recipes for the recipe screens.
+
+A recipe's score is the fraction of its ingredient list the fridge can cover:
+   (# distinct recipe ingredients in the fridge with quantity >= amount needed)
+   / (# entries in the recipe's ingredient list)
+When an ingredient is listed more than once, its first amount is the one checked.
+"""
+
+import collections
+import heapq
+import threading
+
+import numpy as np
+
+class RecipeMatrix(object):
+   """
+   Sparse recipe x ingredient matrix.
+      ids[r]        recipe id of row r (ascending)
+      names[r]      recipe name of row r
+      lengths[r]    number of entries in the recipe's ingredient list
+      indptr        row r's entries are indptr[r]:indptr[r+1]
+      cols[j]       ingredient column of entry j (index into upcs)
+      need[j]       amount of that ingredient the recipe needs
+      rows[j]       row of entry j
+      upcs[c]       ingredient UPC of column c (ascending)
+   """
+
+   def __init__(self, ids, names, ingredients, amounts):
+      """
+      Build the matrix from per recipe ingredient and amount lists.
+      """
+      n = len(ids)
+      self.ids = np.asarray(ids, dtype=np.int64).reshape(n)
+      self.names = list(names)
+      self.lengths = np.zeros(n, dtype=np.int64)
+
+      upc_rows = []
+      need_rows = []
+      for r in range(n):
+         ri = np.asarray(ingredients[r] or [], dtype=np.int64)
+         ra = np.asarray(amounts[r] or [], dtype=np.float64)
+         self.lengths[r] = ra.shape[0]
+         # keep the first occurrence of each ingredient
+         upc, first = np.unique(ri, return_index=True)
+         upc_rows.append(upc)
+         need_rows.append(ra[first])
+
+      counts = np.asarray([u.size for u in upc_rows], dtype=np.int64)
+      self.indptr = np.zeros(n+1, dtype=np.int64)
+      np.cumsum(counts, out=self.indptr[1:])
+      all_upcs = np.concatenate(upc_rows) if n else np.zeros(0, np.int64)
+      self.upcs, self.cols = np.unique(all_upcs, return_inverse=True)
+      self.need = np.concatenate(need_rows) if n else np.zeros(0)
+      self.rows = np.repeat(np.arange(n), counts)
+
+   @classmethod
+   def load(cls, cur):
+      """
+      Load every recipe with one query on cursor cur.
+      """
+      cur.execute("select id,name,ingredients,amounts from recipes order by id")
+      data = cur.fetchall()
+      return cls([d[0] for d in data], [d[1] for d in data],
+                 [d[2] for d in data], [d[3] for d in data])
+
+   def fridge_vector(self, ids, quantities):
+      """
+      Dense per-column vector of fridge quantities. Ingredients missing from
+      the fridge get -inf so they never cover a recipe entry.
+      """
+      have = np.full(self.upcs.shape[0], -np.inf)
+      ids = np.asarray(ids, dtype=np.int64)
+      quantities = np.asarray(quantities, dtype=np.float64)
+      if ids.size and self.upcs.size:
+         col = np.searchsorted(self.upcs, ids)
+         col[col == self.upcs.size] = 0
+         found = self.upcs[col] == ids
+         have[col[found]] = quantities[found]
+      return have
+
+   def covered(self, have):
+      """
+      Number of covered ingredients per recipe for fridge vector have.
+      """
+      ok = have[self.cols] >= self.need
+      return np.bincount(self.rows, weights=ok, minlength=self.ids.shape[0])
+
+   def scores(self, have):
+      """
+      Score of every recipe for fridge vector have.
+      """
+      covered = self.covered(have)
+      out = np.zeros(self.ids.shape[0])
+      np.divide(covered, self.lengths, out=out, where=self.lengths > 0)
+      return out
+
+   def top(self, have, k=5):
+      """
+      Rows of the k best scoring recipes for fridge vector have, best first.
+      Recipes scoring 0 are left out. Ties go to the lower recipe id.
+      Returns (rows, scores).
+      """
+      return top_k(self.scores(have), k)
+
+def top_k(scores, k):
+   """
+   Indices and values of the k largest positive entries of scores, largest first,
+   ties broken by lower index. Uses argpartition, so it is linear in len(scores).
+   """
+   n = scores.shape[0]
+   k = min(k, n)
+   if k <= 0:
+      return np.zeros(0, np.int64), np.zeros(0)
+   # value of the k-th best score
+   kth = scores[np.argpartition(scores, n-k)[n-k]]
+   above = np.flatnonzero(scores > kth)
+   tied = np.flatnonzero(scores == kth)[:k-above.size]
+   rows = np.concatenate([above, tied])
+   rows = rows[scores[rows] > 0]
+   order = np.lexsort((rows, -scores[rows]))
+   rows = rows[order]
+   return rows, scores[rows]
+
+class RecipeIndex(object):
+   """
+   Incrementally maintained recipe scores.
+   Keeps an inverted index from ingredient column to the matrix entries (recipes)
+   that use it, the fridge vector, each recipe's covered ingredient count, and the
+   current top k. A fridge mutation only touches the recipes using that
+   ingredient, and top() is a constant time read.
+   """
+
+   def __init__(self, matrix, k=5):
+      self.matrix = matrix
+      self.k = k
+      # inverted index: entries of column c are entries[colptr[c]:colptr[c+1]]
+      self.entries = np.argsort(matrix.cols, kind='mergesort')
+      self.colptr = np.zeros(matrix.upcs.shape[0]+1, dtype=np.int64)
+      np.cumsum(np.bincount(matrix.cols, minlength=matrix.upcs.shape[0]), out=self.colptr[1:])
+      self.load_fridge([], [])
+
+   def load_fridge(self, ids, quantities):
+      """
+      Recompute everything from the full fridge contents.
+      """
+      m = self.matrix
+      self.have = m.fridge_vector(ids, quantities)
+      self.covered = m.covered(self.have).astype(np.int64)
+      self.score = np.zeros(m.ids.shape[0])
+      np.divide(self.covered, m.lengths, out=self.score, where=m.lengths > 0)
+      self._top = top_k(self.score, self.k)
+
+   def column(self, upc):
+      """
+      Matrix column of ingredient upc, or -1 if no recipe uses it.
+      """
+      upcs = self.matrix.upcs
+      c = np.searchsorted(upcs, upc)
+      if c < upcs.shape[0] and upcs[c] == upc:
+         return int(c)
+      return -1
+
+   def set_quantity(self, upc, quantity):
+      """
+      Record that the fridge now holds quantity of ingredient upc.
+      quantity None means the ingredient was removed from the fridge.
+      """
+      c = self.column(upc)
+      if c < 0:
+         return
+      m = self.matrix
+      new = -np.inf if quantity is None else float(quantity)
+      old = self.have[c]
+      self.have[c] = new
+      if new == old:
+         return
+
+      # adjust only the recipes that use this ingredient
+      entries = self.entries[self.colptr[c]:self.colptr[c+1]]
+      need = m.need[entries]
+      delta = (new >= need).astype(np.int64) - (old >= need)
+      changed = delta != 0
+      if not changed.any():
+         return
+      rows = m.rows[entries[changed]]
+      self.covered[rows] += delta[changed]
+      self.score[rows] = self.covered[rows].astype(np.float64)/m.lengths[rows]
+      self._update_top(rows)
+
+   def _update_top(self, rows):
+      top_rows, top_scores = self._top
+      if not np.isin(rows, top_rows).any():
+         # the top list is untouched unless one of rows now beats its weakest entry
+         scores = self.score[rows]
+         if top_rows.shape[0] < self.k:
+            beats = scores > 0
+         else:
+            weakest = top_scores[-1]
+            beats = (scores > weakest) | ((scores == weakest) & (rows < top_rows[-1]))
+         if not beats.any():
+            return
+      self._top = top_k(self.score, self.k)
+
+   def top(self):
+      """
+      Rows and scores of the current top k recipes, best first. See top_k().
+      """
+      return self._top
+
+def stream_top(cur, fridge_ids, fridge_qty, k=5, batch=500):
+   """
+   Top k recipes for the given fridge contents, read batch recipes at a time from
+   cursor cur (a named, server-side cursor keeps the catalog out of memory).
+   Each batch is scored as its own RecipeMatrix and the best k seen so far are
+   kept in a heap, so memory does not depend on the size of the catalog.
+   Recipe ids need not be contiguous.
+   Returns (ids, names, scores), best first, with the same ordering as top_k().
+   """
+   if hasattr(cur, 'itersize'):
+      cur.itersize = batch
+   cur.execute("select id,name,ingredients,amounts from recipes")
+
+   heap = [] # min-heap of (score, -id, name), size <= k
+   while True:
+      data = cur.fetchmany(batch)
+      if not data:
+         break
+      # rows in id order, so ties within the batch go to the lower id
+      data.sort(key=lambda d: d[0])
+      m = RecipeMatrix([d[0] for d in data], [d[1] for d in data],
+                       [d[2] for d in data], [d[3] for d in data])
+      rows, scores = m.top(m.fridge_vector(fridge_ids, fridge_qty), k)
+      for r, score in zip(rows, scores):
+         item = (float(score), -int(m.ids[r]), m.names[r])
+         if len(heap) < k:
+            heapq.heappush(heap, item)
+         elif item[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, item)
+
+   best = sorted(heap, reverse=True)
+   return ([-item[1] for item in best], [item[2] for item in best],
+           [item[0] for item in best])
+
+# one recipe plus the names of its ingredients (in recipe order) from codes
+DETAIL_QUERY = ("select r.id,r.name,r.ingredients,r.amounts,r.instructions,"
+                "array(select c.name from unnest(r.ingredients) with ordinality as u(id,n) "
+                "left join codes c on c.id = u.id order by u.n) "
+                "from recipes r where r.id = any(%s)")
+
+class RecipeDetail(object):
+   """
+   Everything the recipe screens show about one recipe.
+      ingredients   ingredient UPCs
+      quantities    amount of each ingredient used
+      instructions  list of instruction steps
+      amounts       display strings "quantity ingredient name"
+   """
+
+   __slots__ = ('id', 'name', 'ingredients', 'quantities', 'instructions', 'amounts')
+
+   def __init__(self, row):
+      self.id = int(row[0])
+      self.name = row[1]
+      self.ingredients = row[2]
+      self.quantities = row[3]
+      self.instructions = row[4].split("\n") #instructions separated by line carriage in db
+      self.amounts = [str(q) + ' ' + (n or '') for q,n in zip(row[3], row[5])]
+
+class RecipeCache(object):
+   """
+   LRU cache of RecipeDetail keyed by recipe id. Details are loaded with a single
+   query per batch of recipes. db is the Database to read from and maxsize the
+   number of recipes kept.
+   """
+
+   def __init__(self, db, maxsize=32):
+      self.db = db
+      self.maxsize = maxsize
+      self._items = collections.OrderedDict() # id -> RecipeDetail, oldest first
+      self._lock = threading.Lock()
+
+   def _load(self, ids):
+      with self.db.cursor() as cur:
+         cur.execute(DETAIL_QUERY, (list(ids),))
+         data = cur.fetchall()
+      details = [RecipeDetail(row) for row in data]
+      with self._lock:
+         for detail in details:
+            self._items.pop(detail.id, None)
+            self._items[detail.id] = detail
+         while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+      return details
+
+   def get(self, id):
+      """
+      RecipeDetail of recipe id, loading it if it isn't cached.
+      """
+      id = int(id)
+      with self._lock:
+         detail = self._items.pop(id, None)
+         if detail is not None:
+            self._items[id] = detail
+            return detail
+      for detail in self._load([id]):
+         return detail
+      raise KeyError(id)
+
+   def prefetch(self, ids):
+      """
+      Load the recipes in ids that aren't cached yet on a background thread.
+      """
+      with self._lock:
+         missing = [int(id) for id in ids if int(id) not in self._items]
+      if not missing:
+         return None
+      thread = threading.Thread(target=self._load, args=(missing,), name='recipe prefetch')
+      thread.daemon = True
+      thread.start()
+      return thread
+
+   def invalidate(self, id=None):
+      """
+      Forget recipe id, or every recipe if id is None. Call after recipes changes.
+      """
+      with self._lock:
+         if id is None:
+            self._items.clear()
+         else:
+            self._items.pop(int(id), None)
@@ -0,0 +1,121 @@
+"""
+Rendering layer for the Grocery Guard screens.
+Screens describe each frame as a list of drawing operations on a Canvas. Text is
+rendered once per (font, text, color) and reused. The canvas compares each frame
+with the one on screen and, only when something changed, recomposes its
+background surface and pushes just the changed regions with
+pygame.display.update(rects) instead of flipping the whole display.
+"""
+
+import collections
+
+import pygame
+
+class TextCache(object):
+   """
+   LRU cache of rendered text surfaces keyed by (font, text, color).
+   """
+
+   def __init__(self, maxsize=512):
+      self.maxsize = maxsize
+      self._surfaces = collections.OrderedDict()
+
+   def render(self, font, text, color):
+      key = (font, text, tuple(color))
+      surface = self._surfaces.pop(key, None)
+      if surface is None:
+         surface = font.render(text, True, color)
+         while len(self._surfaces) >= self.maxsize:
+            self._surfaces.popitem(last=False)
+      self._surfaces[key] = surface
+      return surface
+
+def op_rect(op):
+   """
+   Screen area covered by a drawing operation.
+   """
+   if op[0] == 'blit':
+      return pygame.Rect(op[2])
+   if op[0] == 'circle':
+      x, y = op[2]
+      r = op[3]
+      return pygame.Rect(x-r, y-r, 2*r+1, 2*r+1)
+   return pygame.Rect(op[2])
+
+class Canvas(object):
+   """
+   Retained drawing surface for one display.
+   Draw a frame with text(), circle() and rect(), then call present().
+   """
+
+   def __init__(self, screen, color=(0,0,0)):
+      self.screen = screen
+      self.color = tuple(color)
+      self.background = pygame.Surface(screen.get_size())
+      self.texts = TextCache()
+      self._ops = [] # operations of the frame being drawn
+      self._shown = None # operations currently on screen, None forces a full update
+
+   def text(self, font, text, color, **pos):
+      """
+      Draw text. pos are pygame.Rect attributes placing it, e.g. center=(x,y) or
+      centery=y,left=x. Returns the text's rect.
+      """
+      surface = self.texts.render(font, text, color)
+      rect = surface.get_rect(**pos)
+      self._ops.append(('blit', surface, tuple(rect)))
+      return rect
+
+   def image(self, surface, **pos):
+      """
+      Draw a pre-rendered surface (label or icon), placed like text().
+      """
+      rect = surface.get_rect(**pos)
+      self._ops.append(('blit', surface, tuple(rect)))
+      return rect
+
+   def circle(self, color, center, radius, width=0):
+      self._ops.append(('circle', tuple(color), tuple(center), radius, width))
+
+   def rect(self, color, rect, width=0):
+      self._ops.append(('rect', tuple(color), tuple(rect), width))
+
+   def invalidate(self):
+      """
+      Force the next present() to update the whole display.
+      """
+      self._shown = None
+
+   def _compose(self, ops):
+      self.background.fill(self.color)
+      for op in ops:
+         if op[0] == 'blit':
+            self.background.blit(op[1], op[2])
+         elif op[0] == 'circle':
+            pygame.draw.circle(self.background, op[1], op[2], op[3], op[4])
+         else:
+            pygame.draw.rect(self.background, op[1], op[2], op[3])
+
+   def present(self):
+      """
+      Finish the frame. If it differs from what is on screen, recompose the
+      background and update the changed regions. Returns the updated rects.
+      """
+      ops, self._ops = self._ops, []
+      if ops == self._shown:
+         return []
+      if self._shown is None:
+         dirty = [self.screen.get_rect()]
+      else:
+         changed = set(ops) ^ set(self._shown)
+         if changed:
+            dirty = [op_rect(op) for op in changed]
+         else:
+            # same operations in a different order
+            dirty = [op_rect(op) for op in ops]
+      self._shown = ops
+      self._compose(ops)
+      for rect in dirty:
+         self.screen.blit(self.background, rect, rect)
+      pygame.display.update(dirty)
+      return dirty
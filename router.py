@@ -0,0 +1,159 @@
+"""
+Screen router for the Grocery Guard.
+Each screen is an object with enter/handle_event/render/exit hooks, and the
+router keeps the screens in an explicit navigation stack instead of having screen
+functions call each other. Navigating away from a screen returns to the router,
+so nothing accumulates on the Python stack and a screen's data is released as
+soon as it leaves the stack.
+"""
+
+import timeit
+
+from pygame.locals import MOUSEBUTTONDOWN, MOUSEBUTTONUP
+
+class Screen(object):
+   """
+   Base class for screens. The router sets .router before calling enter().
+      enter()             the screen became the current one (pushed or uncovered)
+      handle_event(event) a pygame event arrived while the screen is current
+      render(canvas)      describe the next frame on canvas
+      exit()              the screen stopped being current (covered or removed)
+   """
+
+   router = None
+
+   def enter(self):
+      pass
+
+   def handle_event(self, event):
+      pass
+
+   def render(self, canvas):
+      pass
+
+   def exit(self):
+      pass
+
+class Router(object):
+   """
+   Navigation stack of screens drawn on canvas, with events from loop (an
+   EventLoop). The bottom of the stack is the root (home) screen.
+   If stats (a stats.Stats) is given, each screen's frame time (render and
+   present) is recorded as 'frame: <screen>', and the time from taking a batch
+   with a tap off the queue to presenting the frame as 'input: <screen>'.
+   """
+
+   def __init__(self, loop, canvas, stats=None):
+      self.loop = loop
+      self.canvas = canvas
+      self.stats = stats
+      self.overlay = None # function(canvas) drawn over every frame, e.g. a debug overlay
+      self.handlers = {} # event type -> function(event) run whichever screen is current
+      self.stack = []
+
+   @property
+   def current(self):
+      return self.stack[-1] if self.stack else None
+
+   def on(self, event_type, handler):
+      """
+      Call handler(event) for events of event_type instead of handing them to the
+      current screen, for app wide events such as timers that no screen owns.
+      """
+      self.handlers[event_type] = handler
+
+   def _enter(self, screen):
+      screen.router = self
+      screen.enter()
+      self.loop.wake() # draw the first frame without waiting for an event
+
+   def _leave(self):
+      # exit the current screen, if any
+      if self.stack:
+         self.stack[-1].exit()
+
+   def push(self, screen):
+      """
+      Open screen on top of the current one.
+      """
+      self._leave()
+      self.stack.append(screen)
+      self._enter(screen)
+
+   def replace(self, screen):
+      """
+      Swap the current screen for screen, e.g. to show another page of a list.
+      """
+      self._leave()
+      if self.stack:
+         self.stack.pop()
+      self.stack.append(screen)
+      self._enter(screen)
+
+   def pop(self):
+      """
+      Close the current screen and go back to the one below it.
+      """
+      self._leave()
+      self.stack.pop()
+      if self.stack:
+         self._enter(self.stack[-1])
+
+   def home(self):
+      """
+      Close every screen above the root and go back to it.
+      """
+      self._leave()
+      del self.stack[1:]
+      self._enter(self.stack[0])
+
+   def switch(self, screen):
+      """
+      Close every screen above the root and open screen on top of it.
+      Used by the menu bar buttons that jump between top level screens.
+      """
+      self._leave()
+      del self.stack[1:]
+      self.stack.append(screen)
+      self._enter(screen)
+
+   def dispatch(self, events):
+      """
+      Hand events to the current screen (or the handler registered for their
+      type), then draw and present its frame. Events after a navigation go to the
+      screen navigated to.
+      """
+      start = timeit.default_timer()
+      tapped = None # screen that got a tap in this batch
+      for event in events:
+         if not self.stack:
+            return
+         handler = self.handlers.get(event.type)
+         if handler is not None:
+            handler(event)
+            continue
+         if tapped is None and event.type in (MOUSEBUTTONDOWN, MOUSEBUTTONUP):
+            tapped = type(self.stack[-1]).__name__
+         self.stack[-1].handle_event(event)
+      if self.stack:
+         screen = self.stack[-1]
+         frame = timeit.default_timer()
+         screen.render(self.canvas)
+         if self.overlay is not None:
+            self.overlay(self.canvas)
+         self.canvas.present()
+         if self.stats is not None:
+            end = timeit.default_timer()
+            self.stats.record('frame: ' + type(screen).__name__, (end-frame)*1000.0)
+            if tapped is not None:
+               self.stats.record('input: ' + tapped, (end-start)*1000.0)
+
+   def run(self, screen=None):
+      """
+      Show screen as the root (unless one was already pushed) and process events
+      until the stack is empty.
+      """
+      if screen is not None:
+         self.push(screen)
+      while self.stack:
+         self.dispatch(self.loop.events())
@@ -0,0 +1,226 @@
+"""
+Out of process barcode scanner for the Grocery Guard.
+A child process owns the camera, converts each new frame to grayscale straight
+into a shared memory buffer and decodes it with zbar, so capture and decoding run
+on another core and never stall the UI. Decoded UPCs are sent back over a queue
+with zbar's quality score. The newest grayscale frame can be read from the shared
+buffer in the UI process without pickling it. If scanning fails (no camera,
+no zbar, a capture error) the failure is sent back too and logged, and the child
+tries again after a growing delay. The retries run in the child, which is forked
+once at startup, so the threaded UI process is never forked again.
+"""
+
+from __future__ import print_function
+
+import multiprocessing
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from barcode import GrayscaleConverter, ChangeGate, PollInterval
+from capture import CaptureSession
+from stats import Stats
+
+def decode(scanner, gray):
+   """
+   (upc, quality) of the first UPC zbar.Scanner scanner finds in gray, or None.
+   """
+   for result in scanner.scan(gray):
+      # By default zbar returns barcode data as byte array, so decode byte array
+      try:
+         return int(result.data.decode("ascii")), result.quality
+      except ValueError:
+         # not a numeric code
+         continue
+   return None
+
+class ScannerProcess(object):
+   """
+   source is a picklable callable returning the frame source to capture from in
+   the child, e.g. functools.partial(PygameFrameSource, devices, res); res is
+   its (width,height). threshold, fast and slow configure the ChangeGate and
+   PollInterval pacing the decoder. The same UPC isn't reported again until it
+   has been out of view for repeat seconds. If stats is given, the child's scan
+   phase timings are merged into it as 'scanner' every stats_interval seconds.
+   A failed scan is retried in the child after restart seconds, doubling up to
+   max_restart while it keeps failing; None disables retries. error holds the last
+   failure.
+   """
+
+   def __init__(self, source, res, threshold=4.0, fast=0.2, slow=2.0, repeat=2.0,
+                stats=None, stats_interval=10.0, restart=5.0, max_restart=60.0):
+      self.source = source
+      self.shape = (res[1], res[0])
+      self.threshold = threshold
+      self.fast = fast
+      self.slow = slow
+      self.repeat = repeat
+      self.stats = stats
+      self.stats_interval = stats_interval
+      self.restart = restart
+      self.max_restart = max_restart
+      self.error = None # repr of the child's last exception
+      # newest grayscale frame, written by the child under frame_lock
+      self.frame = multiprocessing.RawArray('B', res[0]*res[1])
+      self.frame_lock = multiprocessing.Lock()
+      self.seq = multiprocessing.RawValue('L', 0) # frames written so far
+      # (upc, quality) of decoded barcodes, ('stats', snapshot) or ('error', repr)
+      self.results = multiprocessing.Queue()
+      self.active = multiprocessing.Event() # decode only while set
+      self.active.set()
+      self.stopping = multiprocessing.Event()
+      self.process = None
+      self._relay = None
+
+   def start(self, callback=None):
+      """
+      Start the scanner process. If callback is given, a thread in this process
+      calls callback(upc, quality) for every decoded barcode. Safe to call twice.
+      """
+      if self.process is not None:
+         return
+      self.process = multiprocessing.Process(target=self._run, name='scanner')
+      self.process.daemon = True
+      self.process.start()
+      if callback is not None:
+         self._relay = threading.Thread(target=self._forward, args=(callback,), name='scanner-relay')
+         self._relay.daemon = True
+         self._relay.start()
+
+   def pause(self):
+      """
+      Stop decoding (the camera stays open) until resume().
+      """
+      self.active.clear()
+
+   def resume(self):
+      self.active.set()
+
+   def stop(self):
+      self.stopping.set()
+      self.active.set()
+      if self.process is not None:
+         self.process.join(2.0)
+         if self.process.is_alive():
+            self.process.terminate()
+         self.process = None
+      self.results.put(None) # ends the relay thread
+      if self._relay is not None:
+         self._relay.join(1.0)
+         self._relay = None
+
+   def get(self, timeout=None):
+      """
+      Next (upc, quality) decoded, waiting up to timeout seconds. None on timeout.
+      """
+      try:
+         return self.results.get(True, timeout)
+      except Exception: # Queue.Empty
+         return None
+
+   def snapshot(self):
+      """
+      Copy of the newest grayscale frame as a (height,width) uint8 array, or None
+      if no frame has been captured yet.
+      """
+      with self.frame_lock:
+         if not self.seq.value:
+            return None
+         return np.frombuffer(self.frame, np.uint8).reshape(self.shape).copy()
+
+   def _forward(self, callback):
+      while True:
+         hit = self.results.get()
+         if hit is None:
+            break
+         if hit[0] == 'error':
+            self.error = hit[1]
+            if self.stats is not None:
+               self.stats.count('scanner.errors')
+            print('scanner failed: ' + hit[1])
+            continue
+         if hit[0] == 'stats':
+            if self.stats is not None:
+               self.stats.merge('scanner', hit[1])
+            continue
+         callback(*hit)
+
+   def _run(self):
+      # child process: report any failure instead of dying silently, then retry
+      # here rather than having the UI process fork a new child
+      delay = self.restart
+      while not self.stopping.is_set():
+         started = time.time()
+         try:
+            self._scan()
+            return
+         except Exception as e:
+            traceback.print_exc()
+            self.results.put(('error', repr(e)))
+         if self.restart is None:
+            return
+         if time.time()-started > self.max_restart:
+            delay = self.restart # it had been working, start the backoff over
+         if self.stopping.wait(delay):
+            return
+         delay = min(delay*2, self.max_restart)
+         print('restarting scanner')
+
+   def _scan(self):
+      # owns the camera and the zbar scanner
+      import zbar
+      stats = Stats()
+      sent = time.time() # last time stats were sent
+      gray = np.frombuffer(self.frame, np.uint8).reshape(self.shape)
+      converter = GrayscaleConverter(gray=gray)
+      gate = ChangeGate(self.threshold)
+      poll = PollInterval(self.fast, self.slow)
+      scanner = zbar.Scanner()
+      session = CaptureSession(self.source(), depth=1)
+      with stats.timer('scan.camera_start'):
+         session.start()
+      seen = -1 # capture sequence number of the last processed frame
+      last = None # last reported upc
+      last_time = 0.0 # last time it was in view
+      try:
+         while not self.stopping.is_set():
+            if self.stats is not None and time.time()-sent >= self.stats_interval:
+               self.results.put(('stats', stats.snapshot()))
+               sent = time.time()
+            if not self.active.wait(0.5):
+               continue
+            with stats.timer('scan.capture'):
+               frame = session.latest(timeout=1.0)
+            if session.error is not None:
+               raise session.error
+            if frame is None or session.seq == seen:
+               time.sleep(self.fast)
+               continue
+            seen = session.seq
+            stats.count('scan.frames')
+            with stats.timer('scan.grayscale'):
+               with self.frame_lock:
+                  converter.convert_surface(frame)
+                  self.seq.value += 1
+            # skip the zbar decode if the scene hasn't changed since the last frame
+            with stats.timer('scan.gate'):
+               changed = gate.changed(gray)
+            hit = None
+            if changed:
+               with stats.timer('scan.decode'):
+                  hit = decode(scanner, gray)
+            else:
+               stats.count('scan.skipped')
+            if hit is not None:
+               stats.count('scan.decoded')
+               now = time.time()
+               if hit[0] != last or now-last_time > self.repeat:
+                  self.results.put(hit)
+               last = hit[0]
+               last_time = now
+               gate.reset()
+            time.sleep(poll.update(gate.active))
+      finally:
+         session.stop()
@@ -0,0 +1,179 @@
+"""
+Expiry event scheduler for the Grocery Guard.
+Keeps a min-heap of the next date on which each fridge item's notification changes
+(enters the expiry window, counts down, expires) and a cached set of current
+notifications. A background thread sleeps until the earliest deadline, updates only
+the items that are due, and reports the change through a callback. Fridge
+mutations update the cache incrementally.
+"""
+
+import datetime
+import heapq
+import threading
+import time
+
+def expiry_message(days):
+   """
+   Notification message for an item expiring in days days.
+   """
+   if days < 0:
+      return "expired " + str(-days) + " days ago"
+   return "expiring in " + str(days) + " days"
+
+def seconds_until(date):
+   """
+   Seconds from now until local midnight at the start of date.
+   """
+   midnight = datetime.datetime.combine(date, datetime.time())
+   return max(0.0, time.mktime(midnight.timetuple()) - time.time())
+
+class ExpiryScheduler(object):
+   """
+   exp_days is the number of days before expiration to start notifying and low the
+   quantity at or below which an item is running low (EXP_DAYS and ING_LOW).
+   notify is called with the number of notifications whenever the cached set
+   changes. today returns the current date and can be replaced for testing.
+   """
+
+   def __init__(self, exp_days, low, notify=None, today=datetime.date.today):
+      self.exp_days = exp_days
+      self.low = low
+      self.notify = notify
+      self.today = today
+      self.items = {} # id -> [name, quantity, expires, version]
+      self.order = [] # item ids in fridge order
+      self.cache = {} # id -> list of (id, name, message, expired) notifications
+      self.count = 0 # number of cached notifications
+      self._heap = [] # (date, id, version) of each item's next change
+      self._cond = threading.Condition()
+      self._running = False
+      self._thread = None
+
+   def load(self, items):
+      """
+      Replace all items. items is an iterable of (id, name, quantity, expires date).
+      """
+      with self._cond:
+         self.items = {}
+         self.order = []
+         self.cache = {}
+         self._heap = []
+         for id, name, quantity, expires in items:
+            self._set(id, name, quantity, expires)
+         self._changed()
+
+   def update(self, id, quantity, name=None, expires=None):
+      """
+      Record a fridge mutation. quantity None removes the item. name and expires
+      are needed for items the scheduler doesn't know yet and are optional otherwise.
+      """
+      with self._cond:
+         item = self.items.get(id)
+         if quantity is None:
+            if item is None:
+               return
+            del self.items[id]
+            self.order.remove(id)
+            self.cache.pop(id, None)
+         elif item is None:
+            if name is None or expires is None:
+               return
+            self._set(id, name, quantity, expires)
+         else:
+            self._set(id, name if name is not None else item[0], quantity,
+                      expires if expires is not None else item[2])
+         self._changed()
+
+   def _set(self, id, name, quantity, expires):
+      # (re)compute one item's notifications and schedule its next change
+      item = self.items.get(id)
+      version = item[3]+1 if item is not None else 0
+      if item is None:
+         self.order.append(id)
+      self.items[id] = [name, quantity, expires, version]
+      self._refresh(id)
+
+   def _refresh(self, id):
+      name, quantity, expires, version = self.items[id]
+      today = self.today()
+      days = (expires - today).days
+      notes = []
+      if quantity <= self.low:
+         notes.append((id, name, "low", False))
+      if days <= self.exp_days:
+         notes.append((id, name, expiry_message(days), days < 0))
+         # message counts down (or up, once expired) every day
+         due = today + datetime.timedelta(1)
+      else:
+         due = expires - datetime.timedelta(self.exp_days)
+      if notes:
+         self.cache[id] = notes
+      else:
+         self.cache.pop(id, None)
+      heapq.heappush(self._heap, (due, id, version))
+
+   def _changed(self):
+      self.count = sum(len(notes) for notes in self.cache.values())
+      self._cond.notify_all()
+      if self.notify is not None:
+         self.notify(self.count)
+
+   def notifications(self):
+      """
+      Current notifications as a list of (id, name, message, expired) tuples, in
+      fridge order with the low notification before the expiry one.
+      """
+      with self._cond:
+         out = []
+         for id in self.order:
+            out.extend(self.cache.get(id, ()))
+         return out
+
+   def run_due(self):
+      """
+      Refresh every item whose next change is due. Returns True if any was.
+      """
+      with self._cond:
+         today = self.today()
+         due = False
+         while self._heap and self._heap[0][0] <= today:
+            date, id, version = heapq.heappop(self._heap)
+            item = self.items.get(id)
+            # skip entries made stale by a later mutation
+            if item is None or item[3] != version:
+               continue
+            item[3] += 1
+            self._refresh(id)
+            due = True
+         if due:
+            self._changed()
+         return due
+
+   def start(self):
+      """
+      Start the background thread. Safe to call twice.
+      """
+      if self._running:
+         return
+      self._running = True
+      self._thread = threading.Thread(target=self._run, name='expiry')
+      self._thread.daemon = True
+      self._thread.start()
+
+   def stop(self):
+      with self._cond:
+         self._running = False
+         self._cond.notify_all()
+      if self._thread is not None:
+         self._thread.join(1.0)
+         self._thread = None
+
+   def _run(self):
+      while self._running:
+         self.run_due()
+         with self._cond:
+            if not self._running:
+               break
+            # sleep until the earliest deadline, or until a mutation wakes us
+            timeout = seconds_until(self._heap[0][0]) if self._heap else None
+            self._cond.wait(timeout)
@@ -0,0 +1,177 @@
+"""
+Text to speech for the Grocery Guard recipe instructions.
+Speech is synthesized by a command writing WAV audio to stdout (espeak) and played
+by a command reading it from stdin (aplay), connected through pipes instead of a
+file on the SD card. Synthesized audio is kept in memory keyed by a hash of the
+text, and the next step can be synthesized in the background while the current
+one plays, so it starts speaking as soon as it is shown. The player is a managed
+child process that is terminated and reaped when speech stops.
+"""
+
+import collections
+import hashlib
+import os
+import subprocess
+import threading
+
+class AudioCache(object):
+   """
+   LRU cache of synthesized audio keyed by content hash.
+   """
+
+   def __init__(self, maxsize=32):
+      self.maxsize = maxsize
+      self._audio = collections.OrderedDict()
+      self._lock = threading.Lock()
+
+   def get(self, key):
+      with self._lock:
+         audio = self._audio.pop(key, None)
+         if audio is not None:
+            self._audio[key] = audio
+         return audio
+
+   def put(self, key, audio):
+      with self._lock:
+         self._audio.pop(key, None)
+         self._audio[key] = audio
+         while len(self._audio) > self.maxsize:
+            self._audio.popitem(last=False)
+
+   def __contains__(self, key):
+      with self._lock:
+         return key in self._audio
+
+class Speaker(object):
+   """
+   synth is the synthesizer command, run with the text appended as its last
+   argument. play is the player command. maxsize is the number of synthesized
+   texts kept in memory.
+   """
+
+   CHUNK = 4096 # bytes piped to the player at a time
+
+   def __init__(self, synth=('espeak','-s150','--stdout'), play=('aplay','-q'), maxsize=32):
+      self.synth = list(synth)
+      self.play = list(play)
+      self.cache = AudioCache(maxsize)
+      self.player = None # current player process
+      self._devnull = open(os.devnull, 'wb')
+      self._pending = {} # key -> threading.Event of texts being synthesized ahead
+      self._lock = threading.Lock()
+
+   def key(self, text):
+      """
+      Content hash of text as spoken by the synthesizer command.
+      """
+      digest = hashlib.sha1()
+      for part in self.synth + [text]:
+         if not isinstance(part, bytes):
+            part = part.encode('utf-8')
+         digest.update(part + b'\0')
+      return digest.hexdigest()
+
+   def _synthesizer(self, text):
+      return subprocess.Popen(self.synth + [text], stdout=subprocess.PIPE,
+                              stderr=self._devnull)
+
+   def synthesize(self, text):
+      """
+      Audio of text, from the cache or synthesized now and cached.
+      """
+      key = self.key(text)
+      audio = self.cache.get(key)
+      if audio is None:
+         proc = self._synthesizer(text)
+         audio = proc.communicate()[0]
+         if proc.returncode == 0:
+            self.cache.put(key, audio)
+      return audio
+
+   def prefetch(self, text):
+      """
+      Synthesize text in the background so a later say() starts immediately.
+      """
+      key = self.key(text)
+      with self._lock:
+         if key in self._pending or key in self.cache:
+            return
+         done = self._pending[key] = threading.Event()
+      def run():
+         try:
+            self.synthesize(text)
+         finally:
+            with self._lock:
+               del self._pending[key]
+            done.set()
+      thread = threading.Thread(target=run, name='speech-prefetch')
+      thread.daemon = True
+      thread.start()
+
+   def say(self, text, wait=0.25):
+      """
+      Stop any current speech and start speaking text. Cached audio is piped to the
+      player straight away; otherwise the synthesizer's output is streamed to the
+      player as it is produced (and cached). Waits up to wait seconds for a
+      prefetch of text that is already running.
+      """
+      self.stop()
+      key = self.key(text)
+      with self._lock:
+         done = self._pending.get(key)
+      if done is not None:
+         done.wait(wait)
+      audio = self.cache.get(key)
+      synth = self._synthesizer(text) if audio is None else None
+      player = subprocess.Popen(self.play, stdin=subprocess.PIPE, stderr=self._devnull)
+      self.player = player
+      thread = threading.Thread(target=self._pump, args=(player, key, audio, synth), name='speech')
+      thread.daemon = True
+      thread.start()
+
+   def _pump(self, player, key, audio, synth):
+      # feed the player; keep reading the synthesizer after the player is
+      # stopped so the audio still gets cached
+      playing = True
+      def write(data):
+         try:
+            player.stdin.write(data)
+            return True
+         except (IOError, OSError, ValueError): # player stopped
+            return False
+      if audio is not None:
+         for i in range(0, len(audio), self.CHUNK):
+            if not write(audio[i:i+self.CHUNK]):
+               playing = False
+               break
+      else:
+         chunks = []
+         for chunk in iter(lambda: synth.stdout.read(self.CHUNK), b''):
+            chunks.append(chunk)
+            if playing:
+               playing = write(chunk)
+         if synth.wait() == 0:
+            self.cache.put(key, b''.join(chunks))
+      if playing:
+         try:
+            player.stdin.close()
+         except (IOError, OSError):
+            pass
+
+   def speaking(self):
+      return self.player is not None and self.player.poll() is None
+
+   def stop(self):
+      """
+      Stop the current speech, terminating and reaping the player process.
+      """
+      player, self.player = self.player, None
+      if player is None:
+         return
+      if player.poll() is None:
+         player.terminate()
+      try:
+         player.stdin.close()
+      except (IOError, OSError):
+         pass
+      player.wait()
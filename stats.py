@@ -0,0 +1,246 @@
+"""
+In-memory instrumentation for the Grocery Guard.
+Counters and latency histograms with fixed buckets are cheap enough to record
+on every query, frame and scan. A Stats registry can be dumped to a JSON file
+periodically, drawn as a debug overlay, or sent between processes as a snapshot.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+import timeit
+
+# histogram bucket upper bounds in ms, the last bucket is unbounded
+BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+class Histogram(object):
+   """
+   Latency histogram in ms.
+   """
+
+   __slots__ = ('count', 'total', 'max', 'buckets')
+
+   def __init__(self):
+      self.count = 0
+      self.total = 0.0
+      self.max = 0.0
+      self.buckets = [0]*(len(BUCKETS)+1)
+
+   def record(self, ms):
+      self.count += 1
+      self.total += ms
+      if ms > self.max:
+         self.max = ms
+      i = 0
+      while i < len(BUCKETS) and ms > BUCKETS[i]:
+         i += 1
+      self.buckets[i] += 1
+
+   def percentile(self, p):
+      """
+      Upper bound of the bucket holding the p-th percentile, at most max.
+      """
+      if not self.count:
+         return 0.0
+      rank = p/100.0*self.count
+      seen = 0
+      for i, n in enumerate(self.buckets):
+         seen += n
+         if seen >= rank and n:
+            return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+      return self.max
+
+   def as_dict(self):
+      return {'count': self.count, 'total_ms': self.total, 'max_ms': self.max,
+              'mean_ms': self.total/self.count if self.count else 0.0,
+              'p50_ms': self.percentile(50), 'p95_ms': self.percentile(95),
+              'buckets': list(self.buckets)}
+
+class Stats(object):
+   """
+   Registry of named counters and histograms, safe to use from several threads.
+   """
+
+   def __init__(self):
+      self.counters = {}
+      self.histograms = {}
+      self.snapshots = {} # name -> snapshot merged in from another process
+      self.started = time.time()
+      self._lock = threading.Lock()
+      self._dumper = None
+
+   def count(self, name, n=1):
+      with self._lock:
+         self.counters[name] = self.counters.get(name, 0) + n
+
+   def record(self, name, ms):
+      with self._lock:
+         hist = self.histograms.get(name)
+         if hist is None:
+            hist = self.histograms[name] = Histogram()
+         hist.record(ms)
+
+   def timer(self, name):
+      """
+      Context manager recording the duration of its block under name.
+      """
+      return Timer(self, name)
+
+   def histogram(self, name):
+      return self.histograms.get(name)
+
+   def calls(self, prefix):
+      """
+      Total number of records in the histograms whose names start with prefix.
+      """
+      with self._lock:
+         return sum(hist.count for name, hist in self.histograms.items()
+                    if name.startswith(prefix))
+
+   def snapshot(self):
+      """
+      All counters and histograms as a JSON serializable dict.
+      """
+      with self._lock:
+         out = {'uptime_s': time.time()-self.started,
+                'counters': dict(self.counters),
+                'histograms': dict((name, hist.as_dict())
+                                   for name, hist in self.histograms.items())}
+         for name, snap in self.snapshots.items():
+            out[name] = snap
+      return out
+
+   def merge(self, name, snapshot):
+      """
+      Keep the latest snapshot of another process's Stats under name.
+      """
+      with self._lock:
+         self.snapshots[name] = snapshot
+
+   def dump(self, path):
+      """
+      Write snapshot() to path as JSON, replacing the file atomically.
+      """
+      tmp = path + '.tmp'
+      with open(tmp, 'w') as f:
+         json.dump(self.snapshot(), f, indent=1, sort_keys=True)
+      os.rename(tmp, path)
+
+   def start_dumping(self, path, interval=60.0):
+      """
+      Dump to path every interval seconds from a daemon thread.
+      """
+      if self._dumper is not None:
+         return
+      def run():
+         while True:
+            time.sleep(interval)
+            try:
+               self.dump(path)
+            except (IOError, OSError):
+               pass
+      self._dumper = threading.Thread(target=run, name='stats')
+      self._dumper.daemon = True
+      self._dumper.start()
+
+class Timer(object):
+
+   __slots__ = ('stats', 'name', 'start')
+
+   def __init__(self, stats, name):
+      self.stats = stats
+      self.name = name
+
+   def __enter__(self):
+      self.start = timeit.default_timer()
+      return self
+
+   def __exit__(self, *exc):
+      self.stats.record(self.name, (timeit.default_timer()-self.start)*1000.0)
+
+# --------------- SQL instrumentation ---------------- #
+
+_SPACE = re.compile(r'\s+')
+_PARAMS = re.compile(r'\([^()]*\)(?:\s*,\s*\([^()]*\))+') # (..),(..) value lists
+_NUMBER = re.compile(r'\b\d+\b')
+
+def sql_shape(query):
+   """
+   query with whitespace collapsed, numbers replaced by ? and repeated VALUES
+   tuples collapsed, so calls that differ only in their arguments share a shape.
+   """
+   if isinstance(query, bytes):
+      query = query.decode('utf-8', 'replace')
+   shape = _SPACE.sub(' ', query).strip()
+   shape = _PARAMS.sub('(...),...', shape)
+   return _NUMBER.sub('?', shape)
+
+class InstrumentedCursor(object):
+   """
+   DB-API cursor wrapper recording each execute()'s latency (sql: histogram) and
+   row count (rows: counter) under the query's shape. Other attributes, set or
+   read (e.g. itersize), are the wrapped cursor's.
+   """
+
+   def __init__(self, cur, stats):
+      self._cur = cur
+      self._stats = stats
+
+   def execute(self, query, args=None):
+      shape = sql_shape(query)
+      start = timeit.default_timer()
+      try:
+         return self._cur.execute(query, args)
+      finally:
+         self._stats.record('sql: ' + shape, (timeit.default_timer()-start)*1000.0)
+         rows = getattr(self._cur, 'rowcount', -1)
+         if rows is not None and rows >= 0:
+            self._stats.count('rows: ' + shape, rows)
+
+   def executemany(self, query, args):
+      shape = sql_shape(query)
+      with self._stats.timer('sql: ' + shape):
+         return self._cur.executemany(query, args)
+
+   def __iter__(self):
+      return iter(self._cur)
+
+   def __getattr__(self, name):
+      return getattr(self._cur, name)
+
+   def __setattr__(self, name, value):
+      if name.startswith('_'):
+         object.__setattr__(self, name, value)
+      else:
+         setattr(self._cur, name, value)
+
+class InstrumentedConnection(object):
+
+   def __init__(self, conn, stats):
+      self._conn = conn
+      self._stats = stats
+
+   def cursor(self, *args, **kwargs):
+      return InstrumentedCursor(self._conn.cursor(*args, **kwargs), self._stats)
+
+   def __getattr__(self, name):
+      return getattr(self._conn, name)
+
+   def __setattr__(self, name, value):
+      if name.startswith('_'):
+         object.__setattr__(self, name, value)
+      else:
+         setattr(self._conn, name, value)
+
+def instrumented(connect, stats):
+   """
+   Wrap a Database connect function so its connections record into stats.
+   Connection setup time is recorded as db.connect.
+   """
+   def wrapper(dsn):
+      with stats.timer('db.connect'):
+         conn = connect(dsn)
+      return InstrumentedConnection(conn, stats)
+   return wrapper
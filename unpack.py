@@ -0,0 +1,87 @@
+"""
+Grocery unpacking session for the Grocery Guard.
+While a session is open, confirmed scans are queued instead of written to the
+fridge one at a time, and the queue is flushed in a single batched write when the
+session ends or when it grows past a size or age limit.
+"""
+
+import threading
+import time
+import traceback
+
+class UnpackSession(object):
+   """
+   Queue of confirmed item ids.
+   flush is called with the list of queued ids (an id appears once per scan). It
+   may hand the write to another thread, which calls requeue(ids) if it fails.
+   max_items and max_age (seconds since the oldest queued scan) trigger an early
+   flush, so a forgotten session doesn't hold items back for long.
+   """
+
+   def __init__(self, flush, max_items=20, max_age=60.0, clock=time.time):
+      self.flush_items = flush
+      self.max_items = max_items
+      self.max_age = max_age
+      self.clock = clock
+      self.queue = []
+      self.started = None # time the oldest queued scan was added
+      self.closed = False
+      self._lock = threading.Lock()
+
+   def add(self, id):
+      """
+      Queue one scanned item, flushing if a limit is reached.
+      """
+      with self._lock:
+         if not self.queue:
+            self.started = self.clock()
+         self.queue.append(id)
+      self.poll()
+
+   def poll(self):
+      """
+      Flush if the queue is full or too old. Call regularly from the UI loop.
+      Returns True if it flushed.
+      """
+      with self._lock:
+         due = self.queue and (len(self.queue) >= self.max_items or
+                               self.clock()-self.started >= self.max_age)
+      if due:
+         self.flush()
+         return True
+      return False
+
+   def flush(self):
+      """
+      Write everything queued so far.
+      """
+      with self._lock:
+         if not self.queue:
+            return
+         queue, self.queue = self.queue, []
+         self.started = None
+      try:
+         self.flush_items(queue)
+      except Exception:
+         traceback.print_exc()
+         self.requeue(queue)
+
+   def requeue(self, ids):
+      """
+      Put back scans whose write failed, so the next flush retries them. Returns
+      False if the session is already closed and the scans are lost.
+      """
+      with self._lock:
+         if self.closed:
+            return False
+         self.queue = list(ids) + self.queue
+         self.started = self.clock()
+         return True
+
+   def close(self):
+      """
+      End the session, writing anything still queued.
+      """
+      self.flush()
+      with self._lock:
+         self.closed = True